@@ -0,0 +1,242 @@
+"""Benchmark di valutazione e viste su un database sintetico.
+
+Esempi:
+    python benchmark.py --users 100000 --leagues 5000 --bets 10000000
+    python benchmark.py --reuse --output bench.jsonl
+
+Ogni esecuzione aggiunge una riga JSON a --output, con commit git e parametri,
+così i risultati di commit diversi si possono confrontare.
+
+--db è il database di partenza e non viene mai modificato: ogni esecuzione lavora su
+una copia (<db>.run), quindi con --reuse valuta sempre le stesse scommesse pendenti.
+"""
+import argparse
+import json
+import os
+import random
+import sqlite3
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+# ================= CONFIG =================
+TEAMS = [
+    "Atalanta", "Bologna", "Cagliari", "Como", "Empoli", "Fiorentina", "Genoa",
+    "Hellas Verona", "Inter", "Juventus", "Lazio", "Lecce", "Milan", "Monza",
+    "Napoli", "Parma", "Roma", "Torino", "Udinese", "Venezia",
+]
+SEASON_START = datetime(2025, 8, 23, 18, 0, tzinfo=timezone.utc)
+CHUNK = 50_000
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark Serie A Predictor")
+    parser.add_argument("--db", default="bench.db", help="database di partenza da generare/riusare")
+    parser.add_argument("--users", type=int, default=10_000)
+    parser.add_argument("--leagues", type=int, default=500)
+    parser.add_argument("--bets", type=int, default=1_000_000)
+    parser.add_argument("--finished-matchdays", type=int, default=20,
+                        help="giornate già concluse al momento della valutazione")
+    parser.add_argument("--repeat", type=int, default=50, help="ripetizioni per le query delle viste")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--reuse", action="store_true", help="non rigenerare il database se esiste")
+    parser.add_argument("--output", default="bench_results.jsonl")
+    return parser.parse_args()
+
+
+# ================= DATASET =================
+def season_fixtures():
+    """380 partite: 38 giornate da 10, una a settimana."""
+    fixtures = []
+    for matchday in range(1, 39):
+        kickoff = SEASON_START + timedelta(weeks=matchday - 1)
+        teams = TEAMS[matchday % len(TEAMS):] + TEAMS[:matchday % len(TEAMS)]
+        for i in range(10):
+            fixtures.append({
+                "id": matchday * 100 + i,
+                "matchday": matchday,
+                "utcDate": (kickoff + timedelta(hours=i % 4)).strftime("%Y-%m-%dT%H:%M:%SZ"),
+                "homeTeam": {"name": teams[i]},
+                "awayTeam": {"name": teams[19 - i]},
+            })
+    return fixtures
+
+
+def finished_payload(fixtures, finished_matchdays, rng):
+    matches = []
+    for f in fixtures:
+        if f["matchday"] > finished_matchdays:
+            continue
+        h, a = rng.randint(0, 4), rng.randint(0, 4)
+        matches.append(dict(f, status="FINISHED", score={"fullTime": {"home": h, "away": a}}))
+    return matches
+
+
+def chunks(rows):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= CHUNK:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def generate(args, fixtures):
+    """Riempie il database con utenti, leghe, classifiche e scommesse pendenti."""
+    rng = random.Random(args.seed)
+    conn = sqlite3.connect(args.db)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=OFF")
+
+    # L'hash non viene mai verificato nel benchmark: un valore fisso evita minuti di bcrypt
+    fake_hash = "$2b$12$" + "x" * 53
+    conn.executemany("INSERT INTO users VALUES(?,?,?,?)", (
+        (f"user{i}@bench", fake_hash, f"Team {i}", 1000) for i in range(args.users)
+    ))
+    conn.executemany("INSERT INTO leagues(name, password) VALUES(?,?)", (
+        (f"Lega {i}", fake_hash) for i in range(args.leagues)
+    ))
+    conn.executemany("INSERT INTO standings VALUES(?,?,0)", (
+        (f"user{i}@bench", f"Lega {i % args.leagues}") for i in range(args.users)
+    ))
+
+    match_ids = [f["id"] for f in fixtures]
+    bets = (
+        (f"user{u}@bench", f"Lega {u % args.leagues}", rng.choice(match_ids),
+         rng.choice("1X2"), f"{rng.randint(0, 4)}-{rng.randint(0, 4)}", rng.randint(1, 50), 0)
+        for u in (rng.randrange(args.users) for _ in range(args.bets))
+    )
+    for batch in chunks(bets):
+        conn.executemany("INSERT INTO bets VALUES(?,?,?,?,?,?,?)", batch)
+
+    conn.execute("""
+        INSERT OR REPLACE INTO leaderboard(league, email, team, points, credits, rank)
+        SELECT s.league, s.email, u.team, s.points, u.credits,
+               ROW_NUMBER() OVER (PARTITION BY s.league ORDER BY s.points DESC, u.credits DESC)
+        FROM standings s
+        JOIN users u ON u.email = s.email
+    """)
+    conn.commit()
+    conn.execute("ANALYZE")
+    conn.close()
+
+
+# ================= MISURE =================
+def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return summary(samples)
+
+
+def summary(samples):
+    ordered = sorted(samples)
+    return {
+        "n": len(samples),
+        "min_ms": ordered[0] * 1000,
+        "p50_ms": statistics.median(ordered) * 1000,
+        "p95_ms": ordered[int(0.95 * (len(ordered) - 1))] * 1000,
+        "max_ms": ordered[-1] * 1000,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def remove_db(path):
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+
+def main():
+    args = parse_args()
+    fresh = not (args.reuse and os.path.exists(args.db))
+    if fresh:
+        remove_db(args.db)
+    work = args.db + ".run"
+    remove_db(work)
+
+    # main.py legge DB_PATH all'import e applica le migrazioni: lavora sempre sulla copia
+    os.environ["DB_PATH"] = work
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import main as app
+
+    rng = random.Random(args.seed)
+    fixtures = season_fixtures()
+    results = {}
+
+    if fresh:
+        start = time.perf_counter()
+        app.migrate(sqlite3.connect(args.db))
+        generate(args, fixtures)
+        results["generate_s"] = time.perf_counter() - start
+
+    # Le misure modificano il database (scommesse piazzate e valutate): si parte da una copia
+    # del database generato, così ogni esecuzione con --reuse misura lo stesso lavoro
+    seed = sqlite3.connect(args.db)
+    seed.backup(app.db.writer())
+    seed.close()
+
+    # Partite note in locale, come dopo una sincronizzazione
+    app.store_matches([dict(f, status="TIMED", score={"fullTime": {"home": None, "away": None}}) for f in fixtures])
+
+    leagues = [f"Lega {rng.randrange(args.leagues)}" for _ in range(args.repeat)]
+    results["ranking_view_sql"] = timed(lambda: app.league_leaderboard(leagues.pop()), args.repeat)
+
+    users = [rng.randrange(args.users) for _ in range(args.repeat)]
+
+    def my_bets():
+        u = users.pop()
+        email, league = f"user{u}@bench", f"Lega {u % args.leagues}"
+        first = app.bets_page(email, league, 0)
+        if first:
+            app.bets_page(email, league, 0, (first[-1][0], first[-1][1]))
+        app.bets_page(email, league, 1)
+
+    results["my_bets_view_sql"] = timed(my_bets, args.repeat)
+
+    upcoming = [f["id"] for f in fixtures if f["matchday"] > args.finished_matchdays] or [fixtures[-1]["id"]]
+    bettors = [rng.randrange(args.users) for _ in range(args.repeat)]
+
+    def place():
+        u = bettors.pop()
+        app.place_bet(f"user{u}@bench", f"Lega {u % args.leagues}", rng.choice(upcoming), "1", "1-0", 1)
+
+    results["place_bet"] = timed(place, args.repeat)
+
+    # Valutazione con l'API sostituita dai risultati generati
+    payload = finished_payload(fixtures, args.finished_matchdays, rng)
+    app.get_matches = lambda *a, **k: payload
+    pending = app.db.reader().execute("SELECT COUNT(*) FROM bets WHERE evaluated=0").fetchone()[0]
+    start = time.perf_counter()
+    app.sync_matches(max_age=0)
+    results["sync_matches_s"] = time.perf_counter() - start
+    start = time.perf_counter()
+    settled = app.evaluate_matches()
+    results["evaluate_matches"] = {"s": time.perf_counter() - start, "settled": settled, "pending_before": pending}
+
+    record = {
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "sqlite": sqlite3.sqlite_version,
+        "params": {k: v for k, v in vars(args).items() if k not in ("output", "db")},
+        "results": results,
+    }
+    with open(args.output, "a") as f:
+        f.write(json.dumps(record) + "\n")
+    print(json.dumps(record, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,252 @@
+"""Sostituto locale di football-data.org per sviluppo offline e test di carico.
+
+Implementa GET /v4/competitions/{code}/matches con i filtri status, dateFrom e dateTo.
+
+Esempi:
+    python mock_server.py                              # stagione generata attorno a oggi
+    python mock_server.py --data sa.json --latency 200 --error-rate 0.05 --rate-limit 10
+    python mock_server.py record --out sa.json         # registra dall'API reale (serve FOOTBALL_API_KEY)
+
+Poi: BASE_URL=http://127.0.0.1:8765/v4 python main.py
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import requests
+
+# ================= CONFIG =================
+REAL_API = "https://api.football-data.org/v4"
+TEAMS = [
+    "Atalanta", "Bologna", "Cagliari", "Como", "Empoli", "Fiorentina", "Genoa",
+    "Hellas Verona", "Inter", "Juventus", "Lazio", "Lecce", "Milan", "Monza",
+    "Napoli", "Parma", "Roma", "Torino", "Udinese", "Venezia",
+]
+MATCH_DURATION = timedelta(minutes=115)
+MATCHES_PATH = re.compile(r"^/v4/competitions/(?P<code>[A-Z0-9]+)/matches/?$")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Mock di football-data.org")
+    parser.add_argument("command", nargs="?", default="serve", choices=["serve", "record"])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--data", help="file JSON registrato: {codice: risposta /matches}")
+    parser.add_argument("--competitions", default="SA", help="codici da generare o registrare, separati da virgola")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--latency", type=float, default=0, help="latenza media in ms")
+    parser.add_argument("--jitter", type=float, default=0, help="variazione massima della latenza in ms")
+    parser.add_argument("--error-rate", type=float, default=0, help="probabilità di rispondere 500/503")
+    parser.add_argument("--rate-limit", type=int, default=0, help="richieste al minuto, 0 = illimitate")
+    parser.add_argument("--out", default="season.json", help="file di destinazione per record")
+    return parser.parse_args()
+
+
+# ================= DATI =================
+def generate_season(code, seed, now=None):
+    """38 giornate settimanali con l'avvio del server a metà stagione.
+
+    Il calendario resta fisso; stato e punteggio li ricalcola play() a ogni richiesta.
+    """
+    # Id stabili tra riavvii e distinti per competizione
+    base = 500_000 if code == "SA" else int(hashlib.sha1(code.encode()).hexdigest()[:4], 16) * 10_000
+    now = now or datetime.now(timezone.utc)
+    start = (now - timedelta(weeks=19)).replace(hour=18, minute=0, second=0, microsecond=0)
+    matches = []
+    for matchday in range(1, 39):
+        teams = TEAMS[matchday % len(TEAMS):] + TEAMS[:matchday % len(TEAMS)]
+        for i in range(10):
+            kickoff = start + timedelta(weeks=matchday - 1, hours=i % 4)
+            matches.append(play({
+                "id": base + matchday * 100 + i,
+                "utcDate": kickoff.strftime("%Y-%m-%dT%H:%M:%SZ"),
+                "matchday": matchday,
+                "homeTeam": {"name": teams[i]},
+                "awayTeam": {"name": teams[19 - i]},
+            }, seed, now))
+    return {"competition": {"code": code}, "matches": matches}
+
+
+def play(match, seed, now):
+    """La partita generata come appare all'istante now: il risultato finale dipende solo dall'id,
+    quello in corso cresce con i minuti giocati."""
+    kickoff = datetime.strptime(match["utcDate"], "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=timezone.utc)
+    rng = random.Random(f"{seed}:{match['id']}")
+    final = {"home": rng.randint(0, 4), "away": rng.randint(0, 4)}
+    if kickoff + MATCH_DURATION <= now:
+        status, score = "FINISHED", final
+    elif kickoff <= now:
+        played = (now - kickoff) / MATCH_DURATION
+        status, score = "IN_PLAY", {side: int(goals * played) for side, goals in final.items()}
+    else:
+        status = "TIMED" if kickoff - now < timedelta(days=14) else "SCHEDULED"
+        score = {"home": None, "away": None}
+    return dict(match, status=status, score={"fullTime": score})
+
+
+def load_data(args):
+    if args.data:
+        with open(args.data) as f:
+            return json.load(f)
+    return {code: generate_season(code, args.seed) for code in args.competitions.split(",")}
+
+
+def filter_matches(matches, query):
+    statuses = set(",".join(query.get("status", [])).split(",")) - {""}
+    date_from = query.get("dateFrom", [None])[0]
+    date_to = query.get("dateTo", [None])[0]
+    selected = []
+    for m in matches:
+        day = m["utcDate"][:10]
+        if statuses and m["status"] not in statuses:
+            continue
+        if date_from and day < date_from:
+            continue
+        if date_to and day > date_to:
+            continue
+        selected.append(m)
+    return selected
+
+
+# ================= SERVER =================
+class RateLimiter:
+    """Finestra fissa di un minuto, con gli stessi header dell'API reale."""
+
+    def __init__(self, per_minute):
+        self.per_minute = per_minute
+        self.lock = threading.Lock()
+        self.window = 0
+        self.used = 0
+
+    def take(self):
+        """Ritorna (consentita, rimanenti, secondi al reset)."""
+        now = time.time()
+        with self.lock:
+            window = int(now // 60)
+            if window != self.window:
+                self.window, self.used = window, 0
+            reset = 60 - int(now % 60)
+            if self.per_minute and self.used >= self.per_minute:
+                return False, 0, reset
+            self.used += 1
+            remaining = self.per_minute - self.used if self.per_minute else 9999
+            return True, remaining, reset
+
+
+def make_handler(data, args):
+    # I dati registrati si servono così come sono; quelli generati seguono l'orologio
+    live = not args.data
+    limiter = RateLimiter(args.rate_limit)
+    rng = random.Random(args.seed)
+    rng_lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def send_json(self, code, payload, headers=None):
+            body = json.dumps(payload).encode()
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            with rng_lock:
+                delay = max(0, args.latency + rng.uniform(-args.jitter, args.jitter)) / 1000
+                fail = rng.random() < args.error_rate
+                error_code = rng.choice([500, 503])
+            time.sleep(delay)
+
+            allowed, remaining, reset = limiter.take()
+            quota = {"X-Requests-Available-Minute": str(remaining), "X-RequestCounter-Reset": str(reset)}
+            if not allowed:
+                quota["Retry-After"] = str(reset)
+                self.send_json(429, {"message": "You reached your request limit.", "errorCode": 429}, quota)
+                return
+            if fail:
+                self.send_json(error_code, {"message": "Simulated failure", "errorCode": error_code}, quota)
+                return
+
+            url = urlparse(self.path)
+            match = MATCHES_PATH.match(url.path)
+            if not match:
+                self.send_json(404, {"message": "Not found", "errorCode": 404}, quota)
+                return
+            competition = data.get(match["code"])
+            if competition is None:
+                self.send_json(404, {"message": "Competition not found", "errorCode": 404}, quota)
+                return
+
+            query = parse_qs(url.query)
+            matches = competition["matches"]
+            if live:
+                now = datetime.now(timezone.utc)
+                matches = [play(m, args.seed, now) for m in matches]
+            matches = filter_matches(matches, query)
+            payload = {
+                "filters": {k: v[0] for k, v in query.items()},
+                "resultSet": {"count": len(matches)},
+                "competition": competition.get("competition", {"code": match["code"]}),
+                "matches": matches,
+            }
+            etag = '"' + hashlib.sha1(json.dumps(payload, sort_keys=True).encode()).hexdigest() + '"'
+            if self.headers.get("If-None-Match") == etag:
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.send_header("Content-Length", "0")
+                for key, value in quota.items():
+                    self.send_header(key, value)
+                self.end_headers()
+                return
+            self.send_json(200, payload, dict(quota, ETag=etag))
+
+        def log_message(self, fmt, *log_args):
+            print(f"[mock] {self.address_string()} {fmt % log_args}")
+
+    return Handler
+
+
+def serve(args):
+    data = load_data(args)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(data, args))
+    total = sum(len(c["matches"]) for c in data.values())
+    print(f"⚽ Mock football-data su http://{args.host}:{args.port}/v4 ({', '.join(data)}: {total} partite)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def record(args):
+    """Salva le risposte dell'API reale (tutti gli stati) per riprodurle con --data."""
+    headers = {"X-Auth-Token": os.environ["FOOTBALL_API_KEY"]}
+    data = {}
+    for code in args.competitions.split(","):
+        r = requests.get(f"{REAL_API}/competitions/{code}/matches", headers=headers, timeout=10)
+        r.raise_for_status()
+        data[code] = r.json()
+        print(f"📼 {code}: {len(data[code].get('matches', []))} partite")
+    with open(args.out, "w") as f:
+        json.dump(data, f)
+    print(f"📼 Salvato in {args.out}")
+
+
+if __name__ == "__main__":
+    arguments = parse_args()
+    if arguments.command == "record":
+        record(arguments)
+    else:
+        serve(arguments)
@@ -1,21 +1,128 @@
 import flet as ft
 import sqlite3
+import atexit
 import requests
 import bcrypt
 import os
+import hashlib
+import secrets
 import re
+import json
 import threading
 import time
-from datetime import datetime
+import random
+import signal
+import socket
+import sys
+import uuid
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import wraps
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 
 # ================= CONFIG =================
 API_KEY = os.environ.get("FOOTBALL_API_KEY", "4b281685a4934c939b278db91318f62b")
 HEADERS = {"X-Auth-Token": API_KEY}
-BASE_URL = "https://api.football-data.org/v4"
+# Offline: avviare mock_server.py e poi BASE_URL=http://127.0.0.1:8765/v4 python main.py
+BASE_URL = os.environ.get("BASE_URL", "https://api.football-data.org/v4")
 
 MAX_PLAYERS = 12
-SESSION_FILE = "session.txt"
-UPDATE_INTERVAL = 300
+
+# Competizioni tra cui una lega può scegliere (codici football-data.org)
+COMPETITIONS = {
+    "SA": "Serie A",
+    "PL": "Premier League",
+    "PD": "La Liga",
+    "BL1": "Bundesliga",
+    "FL1": "Ligue 1",
+    "CL": "Champions League",
+}
+DEFAULT_COMPETITION = "SA"
+# Le partite si mostrano a finestre di kickoff: le giornate di competizioni diverse non
+# coincidono e le fasi a eliminazione diretta non hanno giornata
+FIXTURES_WINDOW = 7 * 86400
+# Le competizioni attive si scaricano in parallelo: il tempo di aggiornamento resta quello della più lenta
+FETCH_WORKERS = int(os.environ.get("FETCH_WORKERS", 4))
+# Aggiornamenti in background delle sessioni (apertura schermata, pulsante aggiorna)
+REFRESH_WORKERS = int(os.environ.get("REFRESH_WORKERS", 4))
+SESSION_KEY = "serie_a_predictor.session"
+# Dopo questo tempo senza accessi il token salvato nel browser non vale più
+SESSION_TTL = 30 * 86400
+DB_PATH = os.environ.get("DB_PATH", "serie_a_predictor.db")
+DB_BUSY_TIMEOUT = 5000
+
+# Pianificazione della valutazione (secondi)
+SETTLE_IDLE_INTERVAL = 6 * 3600
+SETTLE_LIVE_INTERVAL = 60
+SETTLE_MIN_INTERVAL = 30
+MATCH_DURATION = 115 * 60
+# Oltre questo ritardo una partita non ancora FINISHED non si insegue più ogni minuto
+# (rinviata di fatto, dati in ritardo): torna al ritmo normale
+MATCH_OVERDUE_WINDOW = 4 * 3600
+
+# "0" quando la valutazione gira nel processo separato `python main.py settle`:
+# le sessioni dell'app leggono solo dal database e non interrogano mai l'API
+SETTLE_IN_UI = os.environ.get("SETTLE_IN_UI", "1") == "1"
+LEADER_LEASE = 120
+LEADER_RENEW = 30
+
+# Costo bcrypt per i nuovi hash; quelli con costo diverso vengono aggiornati al login
+BCRYPT_ROUNDS = int(os.environ.get("BCRYPT_ROUNDS", 12))
+AUTH_WORKERS = int(os.environ.get("AUTH_WORKERS", 2))
+
+# Secondi di validità della cache API per stato partita ("ALL" = stagione intera)
+CACHE_TTL = {
+    "ALL": 600,
+    "SCHEDULED": 600,
+    "TIMED": 600,
+    "IN_PLAY": 30,
+    "PAUSED": 30,
+    "FINISHED": 3 * 24 * 3600,
+}
+DEFAULT_CACHE_TTL = 300
+
+API_TIMEOUT = 5
+API_RETRIES = 3
+API_BACKOFF = 0.5
+API_BACKOFF_MAX = 8
+API_POOL_SIZE = 10
+
+# Quota di football-data.org (richieste al minuto), condivisa via database tra thread e processi.
+# Le richieste in background lasciano libera una riserva per quelle interattive; chi non trova
+# budget aspetta in coda fino a API_QUEUE_TIMEOUT secondi
+API_RATE_LIMIT = int(os.environ.get("API_RATE_LIMIT", 10))
+API_BACKGROUND_RESERVE = 2
+API_QUEUE_TIMEOUT = 120
+# Il settler aspetta al massimo questo in coda per ogni chiamata (retry compresi): con timeout HTTP
+# e backoff la fase di lavoro resta ben sotto LEADER_LEASE, che in quella fase non viene rinnovato
+API_BACKGROUND_QUEUE_TIMEOUT = 20
+
+# Circuit breaker: dopo API_BREAKER_THRESHOLD errori di fila l'API si considera giù e le chiamate
+# falliscono subito (dati dall'ultima copia buona); una sonda in background riprova dopo il cooldown,
+# che raddoppia a ogni sonda fallita fino a API_BREAKER_COOLDOWN_MAX
+API_BREAKER_THRESHOLD = 3
+API_BREAKER_COOLDOWN = 30
+API_BREAKER_COOLDOWN_MAX = 300
+
+BETS_PAGE_SIZE = 20
+
+# Metriche: endpoint Prometheus su METRICS_PORT e/o riepilogo su stdout ogni METRICS_DUMP secondi
+METRICS_PORT = int(os.environ.get("METRICS_PORT", 0))
+METRICS_DUMP = int(os.environ.get("METRICS_DUMP", 0))
+METRICS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Profilazione SQL (SQL_PROFILE=1): ogni statement con durata e chiamante in SQL_PROFILE_LOG,
+# piano di esecuzione oltre SQL_SLOW_MS e riepilogo dei più costosi all'uscita
+SQL_PROFILE = os.environ.get("SQL_PROFILE", "0") == "1"
+SQL_PROFILE_LOG = os.environ.get("SQL_PROFILE_LOG", "sql_profile.log")
+SQL_SLOW_MS = float(os.environ.get("SQL_SLOW_MS", 50))
+SQL_PROFILE_TOP = 20
+# In più (SQL_TRACE=1) anche gli statement visti solo da SQLite: BEGIN/COMMIT impliciti e script
+SQL_TRACE = os.environ.get("SQL_TRACE", "0") == "1"
+# Stringhe e numeri letterali: nel testo espanso ci sono email e hash delle password
+SQL_LITERAL = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
 
 PRIMARY = "#00d4ff"
 SECONDARY = "#7c3aed"
@@ -23,11 +130,346 @@ SUCCESS = "#10b981"
 DANGER = "#ef4444"
 CARD_BG = "#1a1f3a"
 
+# ================= METRICS =================
+class Metrics:
+    """Contatori e istogrammi di latenza in memoria, con etichette, in formato Prometheus."""
+
+    def __init__(self, buckets=METRICS_BUCKETS):
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+    def inc(self, name, value=1, **labels):
+        key = self._key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        key = self._key(name, labels)
+        with self.lock:
+            h = self.histograms.get(key)
+            if h is None:
+                h = self.histograms[key] = {"buckets": [0] * len(self.buckets), "count": 0, "sum": 0.0}
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    h["buckets"][i] += 1
+                    break
+            h["count"] += 1
+            h["sum"] += seconds
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """Misura il blocco; le etichette si possono completare dentro il blocco."""
+        start = time.perf_counter()
+        try:
+            yield labels
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def timed(self, name):
+        def decorator(fn):
+            @wraps(fn)
+            def wrapper(*args, **kwargs):
+                with self.timer(name):
+                    return fn(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    @staticmethod
+    def _labels(labels, extra=()):
+        pairs = list(labels) + list(extra)
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}"
+
+    def render(self):
+        with self.lock:
+            counters = dict(self.counters)
+            histograms = {k: {"buckets": list(v["buckets"]), "count": v["count"], "sum": v["sum"]}
+                          for k, v in self.histograms.items()}
+        lines = []
+        for name in sorted({k[0] for k in counters}):
+            lines.append(f"# TYPE {name} counter")
+            for (n, labels), value in sorted(counters.items()):
+                if n == name:
+                    lines.append(f"{name}{self._labels(labels)} {value}")
+        for name in sorted({k[0] for k in histograms}):
+            lines.append(f"# TYPE {name} histogram")
+            for (n, labels), h in sorted(histograms.items()):
+                if n != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(self.buckets, h["buckets"]):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{self._labels(labels, [('le', bound)])} {cumulative}")
+                lines.append(f"{name}_bucket{self._labels(labels, [('le', '+Inf')])} {h['count']}")
+                lines.append(f"{name}_sum{self._labels(labels)} {h['sum']:.6f}")
+                lines.append(f"{name}_count{self._labels(labels)} {h['count']}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self):
+        """Riepilogo leggibile: conteggio, media e p95 stimato per istogramma, più i contatori."""
+        with self.lock:
+            counters = dict(self.counters)
+            histograms = {k: dict(v, buckets=list(v["buckets"])) for k, v in self.histograms.items()}
+        lines = []
+        for (name, labels), h in sorted(histograms.items()):
+            p95, cumulative = "+Inf", 0
+            for bound, count in zip(self.buckets, h["buckets"]):
+                cumulative += count
+                if cumulative >= 0.95 * h["count"]:
+                    p95 = f"{bound * 1000:g}ms"
+                    break
+            avg = h["sum"] / h["count"] * 1000
+            lines.append(f"  {name}{self._labels(labels)} n={h['count']} avg={avg:.1f}ms p95<={p95}")
+        for (name, labels), value in sorted(counters.items()):
+            lines.append(f"  {name}{self._labels(labels)} {value}")
+        return "\n".join(lines)
+
+metrics = Metrics()
+
+def serve_metrics(port):
+    """Espone GET /metrics in un thread daemon."""
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = metrics.render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True, name="metrics").start()
+    print(f"📊 Metriche su http://127.0.0.1:{port}/metrics")
+    return server
+
+def dump_metrics(interval):
+    def loop():
+        while True:
+            time.sleep(interval)
+            print("📊 Metriche:\n" + metrics.summary())
+    threading.Thread(target=loop, daemon=True, name="metrics-dump").start()
+
+def start_metrics():
+    if METRICS_PORT:
+        serve_metrics(METRICS_PORT)
+    if METRICS_DUMP:
+        dump_metrics(METRICS_DUMP)
+
+# ================= SQL PROFILER =================
+class SqlProfiler:
+    """Raccoglie durata, chiamante e piano delle query eseguite dalle connessioni profilate."""
+
+    PLANNABLE = ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH", "REPLACE")
+
+    def __init__(self, path, slow_ms):
+        self.path = path
+        self.slow = slow_ms / 1000
+        self.lock = threading.Lock()
+        self.stats = {}
+        self.plans = {}
+        self.log = None
+        self.started = time.time()
+
+    def _write(self, line):
+        with self.lock:
+            if self.log is None:
+                self.log = open(self.path, "a", buffering=1)
+                self.log.write(f"=== run {datetime.now().isoformat(timespec='seconds')} pid={os.getpid()}\n")
+            self.log.write(line + "\n")
+
+    @staticmethod
+    def caller():
+        """Prima funzione fuori dal profiler nello stack: chi ha lanciato la query."""
+        frame = sys._getframe(2)
+        while frame is not None and frame.f_code.co_filename == __file__ and \
+                frame.f_code.co_name in ("execute", "executemany", "executescript", "_run"):
+            frame = frame.f_back
+        if frame is None:
+            return "?"
+        return f"{frame.f_code.co_name}:{frame.f_lineno}"
+
+    def trace(self, statement):
+        # Callback di sqlite3: riceve l'SQL con i parametri già sostituiti, quindi va ripulito
+        self._write(f"TRACE {SQL_LITERAL.sub('?', statement)}")
+
+    def record(self, conn, sql, params, elapsed, caller):
+        key = " ".join(sql.split())
+        with self.lock:
+            s = self.stats.setdefault(key, {"count": 0, "total": 0.0, "max": 0.0, "callers": set()})
+            s["count"] += 1
+            s["total"] += elapsed
+            s["max"] = max(s["max"], elapsed)
+            s["callers"].add(caller)
+            need_plan = elapsed >= self.slow and key not in self.plans
+        self._write(f"{elapsed * 1000:9.2f}ms {caller:<28} {key[:300]}")
+        if need_plan and key.split(" ", 1)[0].upper() in self.PLANNABLE and params is not None:
+            try:
+                plan = [row[-1] for row in sqlite3.Connection.execute(conn, "EXPLAIN QUERY PLAN " + sql, params)]
+            except sqlite3.Error as e:
+                plan = [f"(piano non disponibile: {e})"]
+            with self.lock:
+                self.plans[key] = plan
+            self._write("    PLAN " + "\n    PLAN ".join(plan))
+
+    def summary(self, top=SQL_PROFILE_TOP):
+        with self.lock:
+            ranked = sorted(self.stats.items(), key=lambda kv: kv[1]["total"], reverse=True)[:top]
+            plans = dict(self.plans)
+        lines = [f"=== top {len(ranked)} statement per tempo totale ({time.time() - self.started:.0f}s di esecuzione)"]
+        for key, s in ranked:
+            lines.append(
+                f"{s['total'] * 1000:10.1f}ms totali  {s['count']:7d}x  avg {s['total'] / s['count'] * 1000:.2f}ms"
+                f"  max {s['max'] * 1000:.2f}ms  [{', '.join(sorted(s['callers']))}]"
+            )
+            lines.append(f"    {key[:300]}")
+            for step in plans.get(key, []):
+                lines.append(f"    PLAN {step}")
+        return "\n".join(lines)
+
+    def write_summary(self):
+        if not self.stats:
+            return
+        self._write(self.summary())
+        print(f"🔎 Profilo SQL scritto in {self.path}")
+
+class ProfiledCursor(sqlite3.Cursor):
+    def _run(self, method, sql, params, plan_params):
+        start = time.perf_counter()
+        try:
+            return method(sql, params)
+        finally:
+            profiler.record(self.connection, sql, plan_params, time.perf_counter() - start, profiler.caller())
+
+    def execute(self, sql, params=()):
+        return self._run(super().execute, sql, params, params)
+
+    def executemany(self, sql, seq):
+        return self._run(super().executemany, sql, seq, None)
+
+class ProfiledConnection(sqlite3.Connection):
+    """Connessione che misura ogni statement; usata da Database solo con SQL_PROFILE=1."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if SQL_TRACE:
+            self.set_trace_callback(profiler.trace)
+
+    def cursor(self, factory=ProfiledCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, params=()):
+        return self.cursor().execute(sql, params)
+
+    def executemany(self, sql, seq):
+        return self.cursor().executemany(sql, seq)
+
+    def executescript(self, script):
+        start = time.perf_counter()
+        try:
+            return super().executescript(script)
+        finally:
+            profiler.record(self, script, None, time.perf_counter() - start, profiler.caller())
+
+profiler = None
+if SQL_PROFILE:
+    profiler = SqlProfiler(SQL_PROFILE_LOG, SQL_SLOW_MS)
+    atexit.register(profiler.write_summary)
+
 # ================= DATABASE =================
-conn = sqlite3.connect("serie_a_predictor.db", check_same_thread=False)
-cur = conn.cursor()
+class ThreadConnections:
+    """Connessioni di un thread: quando il thread termina l'oggetto viene raccolto e le chiude."""
+
+    def __init__(self):
+        self.writer = None
+        self.reader = None
+        self.opened = []
+
+class Database:
+    """Una connessione di scrittura e una di sola lettura per thread, in modalità WAL.
+
+    Ogni thread (handler Flet, aggiornamento automatico) usa le proprie connessioni,
+    così le letture delle viste non si bloccano dietro alla valutazione e nessuno
+    condivide più lo stesso cursore. Flet crea un thread per evento: alla sua uscita
+    le connessioni vengono chiuse, altrimenti resterebbero aperte fino allo spegnimento.
+    """
+
+    def __init__(self, path, busy_timeout=DB_BUSY_TIMEOUT):
+        self.path = path
+        self.busy_timeout = busy_timeout
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.connections = []
+
+    def _thread(self):
+        conns = getattr(self.local, "conns", None)
+        if conns is None:
+            conns = self.local.conns = ThreadConnections()
+            # Il finalizer non deve tenere vivo conns: riceve solo la lista delle connessioni
+            weakref.finalize(conns, self._release, conns.opened)
+        return conns
+
+    def _release(self, opened):
+        with self.lock:
+            for db in opened:
+                db.close()
+                if db in self.connections:
+                    self.connections.remove(db)
+            opened.clear()
+
+    def _open(self, conns, readonly):
+        factory = ProfiledConnection if profiler else sqlite3.Connection
+        if readonly:
+            db = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False, factory=factory)
+            db.execute("PRAGMA query_only=ON")
+        else:
+            db = sqlite3.connect(self.path, check_same_thread=False, factory=factory)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+        db.execute(f"PRAGMA busy_timeout={self.busy_timeout}")
+        with self.lock:
+            self.connections.append(db)
+        conns.opened.append(db)
+        return db
+
+    def writer(self):
+        conns = self._thread()
+        if conns.writer is None:
+            conns.writer = self._open(conns, readonly=False)
+        return conns.writer
+
+    def reader(self):
+        conns = self._thread()
+        if conns.reader is None:
+            conns.reader = self._open(conns, readonly=True)
+        return conns.reader
+
+    def close_all(self):
+        """Chiude tutte le connessioni allo spegnimento: l'ultima a chiudersi fa il checkpoint del WAL."""
+        with self.lock:
+            for db in self.connections:
+                db.close()
+            self.connections.clear()
+        self.local = threading.local()
 
-cur.executescript("""
+db = Database(DB_PATH)
+
+# Migrazioni in ordine: (versione, script). Non modificare quelle già rilasciate,
+# aggiungerne sempre di nuove in coda.
+MIGRATIONS = [
+    (1, """
 CREATE TABLE IF NOT EXISTS users(
     email TEXT PRIMARY KEY,
     password TEXT,
@@ -56,93 +498,1109 @@ CREATE TABLE IF NOT EXISTS bets(
     amount INTEGER DEFAULT 0,
     evaluated INTEGER DEFAULT 0
 );
-""")
 
-conn.commit()
+CREATE TABLE IF NOT EXISTS api_cache(
+    url TEXT,
+    status TEXT,
+    etag TEXT,
+    last_modified TEXT,
+    body TEXT,
+    fetched_at REAL,
+    PRIMARY KEY(url, status)
+);
+
+CREATE TABLE IF NOT EXISTS app_state(
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""),
+    (2, """
+-- Settlement: solo le scommesse ancora da valutare, per partita
+CREATE INDEX IF NOT EXISTS idx_bets_pending ON bets(match_id) WHERE evaluated=0;
+
+-- Storico per utente/lega già ordinato e coprente per "Le mie"
+CREATE INDEX IF NOT EXISTS idx_bets_history
+    ON bets(email, league, evaluated, match_id, winner, result, amount);
+
+-- Classifica di lega
+CREATE INDEX IF NOT EXISTS idx_standings_league_points ON standings(league, points);
+"""),
+    (3, """
+CREATE TABLE IF NOT EXISTS matches(
+    id INTEGER PRIMARY KEY,
+    matchday INTEGER,
+    kickoff INTEGER,
+    status TEXT,
+    home_team TEXT,
+    away_team TEXT,
+    home_score INTEGER,
+    away_score INTEGER,
+    updated_at REAL
+);
+
+CREATE INDEX IF NOT EXISTS idx_matches_status_kickoff ON matches(status, kickoff);
+CREATE INDEX IF NOT EXISTS idx_matches_kickoff ON matches(kickoff);
+"""),
+    (4, """
+CREATE TABLE IF NOT EXISTS leaderboard(
+    league TEXT,
+    email TEXT,
+    team TEXT,
+    points INTEGER,
+    credits INTEGER,
+    rank INTEGER,
+    PRIMARY KEY(league, email)
+);
+
+CREATE INDEX IF NOT EXISTS idx_leaderboard_rank ON leaderboard(league, rank);
+
+INSERT OR REPLACE INTO leaderboard(league, email, team, points, credits, rank)
+SELECT s.league, s.email, u.team, s.points, u.credits,
+       ROW_NUMBER() OVER (PARTITION BY s.league ORDER BY s.points DESC, u.credits DESC)
+FROM standings s
+JOIN users u ON u.email = s.email;
+"""),
+    (5, """
+CREATE INDEX IF NOT EXISTS idx_matches_matchday ON matches(matchday, kickoff);
+"""),
+    (6, """
+CREATE TABLE IF NOT EXISTS leader_lock(
+    name TEXT PRIMARY KEY,
+    owner TEXT,
+    expires_at REAL
+);
+"""),
+    (7, """
+CREATE TABLE IF NOT EXISTS api_budget(
+    name TEXT PRIMARY KEY,
+    tokens REAL,
+    updated_at REAL,
+    blocked_until REAL DEFAULT 0
+);
+"""),
+    (8, """
+ALTER TABLE leagues ADD COLUMN competitions TEXT DEFAULT 'SA';
+ALTER TABLE matches ADD COLUMN competition TEXT DEFAULT 'SA';
+"""),
+    # Il watermark della valutazione non esiste più: la valutazione legge la tabella matches
+    (9, """
+DROP TABLE IF EXISTS app_state;
+"""),
+    # Il browser conserva solo un token casuale; qui se ne tiene l'hash e a chi appartiene
+    (10, """
+CREATE TABLE IF NOT EXISTS sessions(
+    token_hash TEXT PRIMARY KEY,
+    email TEXT,
+    league TEXT,
+    last_seen REAL
+);
+CREATE INDEX IF NOT EXISTS idx_sessions_email ON sessions(email);
+"""),
+    (11, """
+CREATE INDEX IF NOT EXISTS idx_matches_competition_kickoff ON matches(competition, kickoff);
+"""),
+]
+
+def migration_statements(script):
+    """Le istruzioni di uno script, una alla volta: executescript chiuderebbe la transazione aperta."""
+    statement = ""
+    for line in script.splitlines(keepends=True):
+        statement += line
+        if sqlite3.complete_statement(statement):
+            yield statement
+            statement = ""
+
+def migrate(conn):
+    """Applica le migrazioni mancanti, ognuna nella propria transazione.
+
+    App e processo `settle` possono partire insieme su un database nuovo: la versione si
+    rilegge dopo aver preso il lock di scrittura (BEGIN IMMEDIATE), così ogni migrazione
+    la applica un solo processo e gli altri la trovano già fatta.
+    """
+    conn.execute("CREATE TABLE IF NOT EXISTS schema_version(version INTEGER PRIMARY KEY, applied_at REAL)")
+    conn.commit()
+    # Senza lock basta a saltare le migrazioni già applicate: le versioni non tornano indietro
+    current = conn.execute("SELECT MAX(version) FROM schema_version").fetchone()[0] or 0
+
+    for version, script in MIGRATIONS:
+        if version <= current:
+            continue
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            current = conn.execute("SELECT MAX(version) FROM schema_version").fetchone()[0] or 0
+            if version <= current:
+                conn.rollback()
+                continue
+            for statement in migration_statements(script):
+                conn.execute(statement)
+            conn.execute("INSERT INTO schema_version VALUES(?, ?)", (version, time.time()))
+            conn.commit()
+        except sqlite3.Error:
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+        print(f"🛠️ Migrazione {version} applicata")
+
+migrate(db.writer())
 
 # ================= API =================
-def get_matches(status="SCHEDULED"):
+class RateLimited(requests.RequestException):
+    """Nessun budget API disponibile entro il tempo massimo di attesa in coda."""
+
+class ApiBudget:
+    """Token bucket sulla tabella api_budget, allineato agli header di quota dell'API.
+
+    Ogni richiesta consuma un token; i token si ricaricano a `per_minute` al minuto.
+    Le richieste "background" partono solo se resta la riserva per quelle "interactive"
+    e cedono il passo quando nello stesso processo c'è un'interattiva in attesa.
+    """
+
+    def __init__(self, name, per_minute, reserve=API_BACKGROUND_RESERVE):
+        self.name = name
+        self.capacity = per_minute
+        self.rate = per_minute / 60
+        self.reserve = reserve
+        self.timeouts = {"interactive": API_QUEUE_TIMEOUT, "background": API_BACKGROUND_QUEUE_TIMEOUT}
+        self.lock = threading.Lock()
+        self.interactive_waiting = 0
+        self.initialized = False
+
+    def _refilled(self):
+        return "MIN(:capacity, tokens + MAX(0, :now - updated_at) * :rate)"
+
+    def try_acquire(self, need):
+        """Consuma un token se ne restano almeno `need`; altrimenti ritorna i secondi da attendere."""
+        now = time.time()
+        args = {"name": self.name, "capacity": self.capacity, "rate": self.rate, "now": now, "need": need}
+        with db.writer() as conn:
+            if not self.initialized:
+                conn.execute(
+                    "INSERT OR IGNORE INTO api_budget(name, tokens, updated_at) VALUES (:name, :capacity, :now)", args
+                )
+                self.initialized = True
+            # Un solo UPDATE: atomico anche tra processi diversi
+            taken = conn.execute(f"""
+                UPDATE api_budget SET tokens = {self._refilled()} - 1, updated_at = :now
+                WHERE name = :name AND blocked_until <= :now AND {self._refilled()} >= :need
+            """, args).rowcount
+            if taken:
+                return 0
+            tokens, blocked_until = conn.execute(
+                f"SELECT {self._refilled()}, blocked_until FROM api_budget WHERE name = :name", args
+            ).fetchone()
+        return max(blocked_until - now, (need - tokens) / self.rate, 0.05)
+
+    def deadline(self, priority="interactive"):
+        return time.time() + self.timeouts[priority]
+
+    def acquire(self, priority="interactive", deadline=None):
+        """Attende in coda un token; solleva RateLimited se non arriva entro `deadline`."""
+        interactive = priority == "interactive"
+        need = 1 if interactive else 1 + self.reserve
+        start = time.time()
+        deadline = deadline or start + self.timeouts[priority]
+        if interactive:
+            with self.lock:
+                self.interactive_waiting += 1
+        try:
+            while True:
+                with self.lock:
+                    yielding = not interactive and self.interactive_waiting > 0
+                wait = 0.2 if yielding else self.try_acquire(need)
+                if not wait:
+                    metrics.observe("api_budget_wait_seconds", time.time() - start, priority=priority)
+                    return
+                if time.time() + wait > deadline:
+                    raise RateLimited(f"Quota API esaurita: nessun budget entro {deadline - start:.0f}s")
+                time.sleep(min(wait, 1))
+        finally:
+            if interactive:
+                with self.lock:
+                    self.interactive_waiting -= 1
+
+    def observe(self, response):
+        """Allinea il bucket a quanto dichiara il server (quota residua e reset, 429)."""
+        remaining = response.headers.get("X-Requests-Available-Minute")
+        reset = response.headers.get("X-RequestCounter-Reset")
+        retry_after = response.headers.get("Retry-After")
+        reset = int(reset) if reset and reset.isdigit() else None
+        now = time.time()
+        args = {"name": self.name, "capacity": self.capacity, "rate": self.rate, "now": now}
+
+        if response.status_code == 429:
+            metrics.inc("api_rate_limited_total")
+            wait = int(retry_after) if retry_after and retry_after.isdigit() else reset or 60
+            with db.writer() as conn:
+                conn.execute(
+                    "UPDATE api_budget SET tokens = 0, updated_at = :now, blocked_until = :until WHERE name = :name",
+                    dict(args, until=now + wait)
+                )
+        elif remaining and remaining.isdigit():
+            # Il server è la fonte di verità: mai più token di quelli che dichiara
+            until = now + reset if int(remaining) == 0 and reset else 0
+            with db.writer() as conn:
+                conn.execute(f"""
+                    UPDATE api_budget SET tokens = MIN({self._refilled()}, :remaining), updated_at = :now,
+                        blocked_until = MAX(blocked_until, :until)
+                    WHERE name = :name
+                """, dict(args, remaining=int(remaining), until=until))
+
+budget = ApiBudget("football-data", API_RATE_LIMIT)
+
+class CircuitOpen(requests.RequestException):
+    """API considerata non raggiungibile: la richiesta non viene nemmeno tentata."""
+
+class CircuitBreaker:
+    """closed -> open dopo `threshold` errori di fila; open -> half_open quando parte la sonda.
+
+    In half_open passa una sola richiesta di prova: se riesce si torna closed,
+    altrimenti open con cooldown raddoppiato; se finisce senza arrivare al server
+    (abandon) si torna open con lo stesso cooldown. Gli iscritti ricevono online True/False.
+    """
+
+    def __init__(self, threshold=API_BREAKER_THRESHOLD, cooldown=API_BREAKER_COOLDOWN,
+                 cooldown_max=API_BREAKER_COOLDOWN_MAX):
+        self.threshold = threshold
+        self.base_cooldown = cooldown
+        self.cooldown = cooldown
+        self.cooldown_max = cooldown_max
+        self.lock = threading.Lock()
+        self.state = "closed"
+        self.failures = 0
+        self.trial = False
+        self.probe = None
+        self.subscribers = {}
+
+    @property
+    def offline(self):
+        return self.state != "closed"
+
+    def allow(self):
+        """True se la richiesta può partire, "trial" se è la prova del circuito half_open."""
+        with self.lock:
+            if self.state == "closed":
+                return True
+            if self.state == "half_open" and not self.trial:
+                self.trial = True
+                return "trial"
+        metrics.inc("api_circuit_rejected_total")
+        return False
+
+    def success(self):
+        with self.lock:
+            recovered = self.state != "closed"
+            self.state, self.failures, self.trial = "closed", 0, False
+            self.cooldown = self.base_cooldown
+        if recovered:
+            print("📡 API di nuovo raggiungibile")
+            self.transition(True)
+
+    def failure(self):
+        with self.lock:
+            self.failures += 1
+            was_closed = self.state == "closed"
+            if self.state == "half_open":
+                self.cooldown = min(self.cooldown_max, self.cooldown * 2)
+            elif self.state == "open" or self.failures < self.threshold:
+                return
+            self.state, self.trial = "open", False
+            cooldown = self.cooldown
+        print(f"📡 API non raggiungibile: modalità offline, nuovo tentativo tra {cooldown}s")
+        self.schedule_probe(cooldown)
+        # Una sonda fallita non cambia nulla per le sessioni: sono già offline
+        if was_closed:
+            self.transition(False)
+
+    def abandon(self):
+        """La prova è finita senza arrivare al server (es. budget API esaurito): si riprova più tardi."""
+        with self.lock:
+            if self.state != "half_open":
+                return
+            self.state, self.trial = "open", False
+            cooldown = self.cooldown
+        self.schedule_probe(cooldown)
+
+    def schedule_probe(self, delay):
+        timer = threading.Timer(delay, self.run_probe)
+        timer.daemon = True
+        timer.start()
+
+    def run_probe(self):
+        with self.lock:
+            if self.state != "open":
+                return
+            self.state, self.trial = "half_open", False
+        if self.probe is None:
+            # Senza sonda sarà la prossima richiesta normale a fare da prova
+            return
+        try:
+            self.probe()
+        except Exception as e:
+            print("Errore sonda API:", e)
+        with self.lock:
+            # La sonda non ha nemmeno chiesto la prova (es. risposta da un'altra richiesta in volo)
+            stuck = self.state == "half_open" and not self.trial
+        if stuck:
+            self.abandon()
+
+    def transition(self, online):
+        metrics.inc("api_circuit_transitions_total", state="closed" if online else "open")
+        with self.lock:
+            callbacks = list(self.subscribers.values())
+        for callback in callbacks:
+            try:
+                callback(online)
+            except Exception as e:
+                print("Errore notifica sessione:", e)
+
+    def subscribe(self, callback):
+        key = object()
+        with self.lock:
+            self.subscribers[key] = callback
+        return key
+
+    def unsubscribe(self, key):
+        with self.lock:
+            self.subscribers.pop(key, None)
+
+breaker = CircuitBreaker()
+
+class FootballClient:
+    """Client HTTP condiviso: connessioni keep-alive, retry con backoff.
+
+    Ogni tentativo finisce in metrics: api_request_seconds (per esito), api_calls_total,
+    api_retries_total, api_timeouts_total e api_request_errors_total.
+    """
+
+    RETRY_STATUS = {429, 500, 502, 503, 504}
+
+    def __init__(self, headers, timeout=API_TIMEOUT, retries=API_RETRIES,
+                 backoff=API_BACKOFF, backoff_max=API_BACKOFF_MAX, pool_size=API_POOL_SIZE):
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.session = requests.Session()
+        self.session.headers.update(headers)
+        adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def _delay(self, attempt, response=None):
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after and retry_after.isdigit():
+            return min(int(retry_after), self.backoff_max)
+        # Full jitter: attesa casuale in [0, backoff * 2^attempt]
+        return random.uniform(0, min(self.backoff_max, self.backoff * 2 ** attempt))
+
+    def get(self, url, headers=None, priority="interactive"):
+        metrics.inc("api_calls_total")
+        # Una sola scadenza per tutta la chiamata: i retry non moltiplicano l'attesa in coda
+        deadline = budget.deadline(priority)
+        for attempt in range(self.retries + 1):
+            # Con l'API giù si fallisce subito invece di aspettare il timeout a ogni tentativo
+            permit = breaker.allow()
+            if not permit:
+                raise CircuitOpen("API non raggiungibile (circuito aperto)")
+            # Ogni tentativo, retry compresi, consuma quota: si mette in coda sul budget condiviso
+            try:
+                budget.acquire(priority, deadline)
+            except Exception:
+                # La prova del circuito non è arrivata al server: va restituita, o resta offline per sempre
+                if permit == "trial":
+                    breaker.abandon()
+                raise
+            start = time.perf_counter()
+            try:
+                r = self.session.get(url, headers=headers, timeout=self.timeout)
+            except requests.Timeout:
+                metrics.observe("api_request_seconds", time.perf_counter() - start, outcome="timeout")
+                metrics.inc("api_timeouts_total")
+                breaker.failure()
+                if attempt == self.retries:
+                    metrics.inc("api_request_errors_total")
+                    raise
+                metrics.inc("api_retries_total")
+                time.sleep(self._delay(attempt))
+                continue
+            except requests.RequestException:
+                metrics.observe("api_request_seconds", time.perf_counter() - start, outcome="error")
+                metrics.inc("api_request_errors_total")
+                breaker.failure()
+                raise
+
+            metrics.observe("api_request_seconds", time.perf_counter() - start, outcome=r.status_code)
+            # 4xx e 429 vengono comunque da un server vivo: solo i 5xx contano come guasto
+            if r.status_code >= 500:
+                breaker.failure()
+            else:
+                breaker.success()
+            budget.observe(r)
+            if r.status_code in self.RETRY_STATUS and attempt < self.retries:
+                metrics.inc("api_retries_total")
+                time.sleep(self._delay(attempt, r))
+                continue
+            if r.status_code >= 400:
+                metrics.inc("api_request_errors_total")
+            return r
+
+api = FootballClient(HEADERS)
+
+def cache_get(url, status):
+    return db.reader().execute(
+        "SELECT etag, last_modified, body, fetched_at FROM api_cache WHERE url=? AND status=?",
+        (url, status)
+    ).fetchone()
+
+def cache_put(url, status, etag, last_modified, body):
+    conn = db.writer()
+    conn.execute("""
+        INSERT OR REPLACE INTO api_cache(url, status, etag, last_modified, body, fetched_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """, (url, status, etag, last_modified, body, time.time()))
+    conn.commit()
+
+def cache_touch(url, status):
+    conn = db.writer()
+    conn.execute("UPDATE api_cache SET fetched_at=? WHERE url=? AND status=?", (time.time(), url, status))
+    conn.commit()
+
+class SingleFlight:
+    """Chiamate concorrenti con la stessa chiave condividono un'unica esecuzione."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+
+    def do(self, key, fn):
+        """Ritorna (risultato, condiviso); se fn solleva, l'eccezione arriva a tutti gli in attesa."""
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = {"done": threading.Event(), "result": None, "error": None}
+        if not leader:
+            call["done"].wait()
+            if call["error"] is not None:
+                raise call["error"]
+            return call["result"], True
+        try:
+            call["result"] = fn()
+            return call["result"], False
+        except BaseException as e:
+            call["error"] = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call["done"].set()
+
+inflight = SingleFlight()
+
+def fetch_matches(url, status, cached, priority="interactive"):
+    """Richiesta vera e propria (condizionale se c'è una copia in cache): (partite, origine)."""
+    headers = {}
+    if cached:
+        if cached[0]:
+            headers["If-None-Match"] = cached[0]
+        if cached[1]:
+            headers["If-Modified-Since"] = cached[1]
+
     try:
-        r = requests.get(
-            f"{BASE_URL}/competitions/SA/matches?status={status}",
-            headers=HEADERS,
-            timeout=5
-        )
+        r = api.get(url, headers=headers, priority=priority)
+        metrics.inc("api_responses_total", status=status, code=r.status_code)
+        metrics.inc("api_response_bytes_total", len(r.content), status=status)
+        if r.status_code == 304 and cached:
+            cache_touch(url, status)
+            return json.loads(cached[2]).get("matches", []), "revalidated"
         r.raise_for_status()
-        return r.json().get("matches", [])
+        cache_put(url, status, r.headers.get("ETag"), r.headers.get("Last-Modified"), r.text)
+        return r.json().get("matches", []), "network"
+    except CircuitOpen:
+        return (json.loads(cached[2]).get("matches", []) if cached else []), "offline"
     except requests.RequestException as e:
         print("Errore API:", e)
-        return []
+        metrics.inc("api_errors_total", status=status)
+        # Meglio dati vecchi che nessun dato
+        if cached:
+            return json.loads(cached[2]).get("matches", []), "stale"
+        return [], "empty"
+
+def get_matches(competition=DEFAULT_COMPETITION, status=None, date_from=None, date_to=None,
+                max_age=None, priority="interactive"):
+    """Partite di una competizione dall'API, con cache (per URL, quindi per competizione);
+    senza status tutta la stagione.
+
+    priority="background" per i controlli periodici: cedono la quota API alle richieste
+    fatte mentre un utente aspetta.
+    """
+    params = [f"status={status}"] if status else []
+    if date_from:
+        params.append(f"dateFrom={date_from}")
+    if date_to:
+        params.append(f"dateTo={date_to}")
+    url = f"{BASE_URL}/competitions/{competition}/matches" + ("?" + "&".join(params) if params else "")
+    status = status or "ALL"
+    # source: cache (fresca), revalidated (304), network (200), stale o empty (errore), offline,
+    # coalesced se la risposta è arrivata da una richiesta identica già in volo
+    with metrics.timer("api_get_matches_seconds", competition=competition, status=status) as labels:
+        cached = cache_get(url, status)
+
+        if max_age is None:
+            max_age = CACHE_TTL.get(status, DEFAULT_CACHE_TTL)
+        if cached and time.time() - cached[3] < max_age:
+            labels["source"] = "cache"
+            return json.loads(cached[2]).get("matches", [])
+
+        # Una sola richiesta per URL: chi arriva mentre è in corso aspetta e ne riusa il risultato
+        (matches, source), shared = inflight.do(url, lambda: fetch_matches(url, status, cached, priority))
+        labels["source"] = "coalesced" if shared else source
+        return matches
+
+# ================= LEADERBOARD =================
+def refresh_leaderboard(conn, emails):
+    """Riallinea la classifica materializzata per le leghe degli utenti indicati.
+
+    Va chiamata nella stessa transazione che ha modificato punti o crediti:
+    vengono ricalcolate solo le leghe coinvolte e riscritte solo le righe cambiate.
+    """
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS touched_users(email TEXT PRIMARY KEY)")
+    conn.execute("DELETE FROM temp.touched_users")
+    conn.executemany("INSERT OR IGNORE INTO temp.touched_users VALUES(?)", [(e,) for e in emails])
+    conn.execute("""
+        INSERT INTO leaderboard(league, email, team, points, credits, rank)
+        SELECT s.league, s.email, u.team, s.points, u.credits,
+               ROW_NUMBER() OVER (PARTITION BY s.league ORDER BY s.points DESC, u.credits DESC)
+        FROM standings s
+        JOIN users u ON u.email = s.email
+        WHERE s.league IN (
+            SELECT league FROM standings WHERE email IN (SELECT email FROM temp.touched_users)
+        )
+        ON CONFLICT(league, email) DO UPDATE SET
+            team=excluded.team,
+            points=excluded.points,
+            credits=excluded.credits,
+            rank=excluded.rank
+        WHERE leaderboard.points IS NOT excluded.points
+           OR leaderboard.credits IS NOT excluded.credits
+           OR leaderboard.rank IS NOT excluded.rank
+           OR leaderboard.team IS NOT excluded.team
+    """)
+
+def league_leaderboard(league):
+    return db.reader().execute("""
+        SELECT team, points, credits
+        FROM leaderboard
+        WHERE league=?
+        ORDER BY rank
+    """, (league,)).fetchall()
+
+# ================= BETS =================
+@metrics.timed("place_bet_seconds")
+def place_bet(email, league, match_id, winner, result, amount):
+    metrics.inc("bets_placed_total")
+    with db.writer() as conn:
+        conn.execute("""
+            INSERT INTO bets (email, league, match_id, winner, result, amount, evaluated)
+            VALUES (?, ?, ?, ?, ?, ?, 0)
+        """, (email, league, match_id, winner, result, amount))
+        conn.execute("UPDATE users SET credits=credits-? WHERE email=?", (amount, email))
+        refresh_leaderboard(conn, [email])
+
+def bets_page(email, league, evaluated, after=None, limit=BETS_PAGE_SIZE):
+    """Una pagina dello storico scommesse, paginata per chiave (match_id, rowid) decrescente.
+
+    `after` è la chiave dell'ultima riga della pagina precedente, None per la prima.
+    """
+    keyset = "AND (b.match_id, b.rowid) < (?, ?)" if after else ""
+    return db.reader().execute(f"""
+        SELECT b.match_id, b.rowid, b.winner, b.result, b.amount,
+               COALESCE(m.home_team || ' - ' || m.away_team, 'Match #' || b.match_id)
+        FROM bets b
+        LEFT JOIN matches m ON m.id = b.match_id
+        WHERE b.email=? AND b.league=? AND b.evaluated=? {keyset}
+        ORDER BY b.match_id DESC, b.rowid DESC
+        LIMIT ?
+    """, (email, league, evaluated, *(after or ()), limit)).fetchall()
+
+def user_bets_for(email, league, match_ids):
+    """Le scommesse dell'utente sulle partite indicate, in una sola query: {match_id: (pronostico, risultato, importo)}."""
+    if not match_ids:
+        return {}
+    marks = ",".join("?" * len(match_ids))
+    rows = db.reader().execute(f"""
+        SELECT match_id, winner, result, amount
+        FROM bets
+        WHERE email=? AND league=? AND match_id IN ({marks})
+    """, (email, league, *match_ids)).fetchall()
+    return {mid: (w, r, amount) for mid, w, r, amount in rows}
+
+# ================= FIXTURES =================
+def parse_kickoff(utc_date):
+    return int(datetime.fromisoformat(utc_date.replace("Z", "+00:00")).timestamp())
+
+def store_matches(matches):
+    """Aggiorna la tabella locale matches con i dati ricevuti dall'API."""
+    if not matches:
+        return
+    now = time.time()
+    rows = [(
+        m["id"],
+        m.get("competition", {}).get("code", DEFAULT_COMPETITION),
+        m.get("matchday"),
+        parse_kickoff(m["utcDate"]),
+        m["status"],
+        m["homeTeam"]["name"],
+        m["awayTeam"]["name"],
+        m["score"]["fullTime"]["home"],
+        m["score"]["fullTime"]["away"],
+        now,
+    ) for m in matches]
+    with db.writer() as conn:
+        conn.executemany("""
+            INSERT INTO matches(id, competition, matchday, kickoff, status, home_team, away_team,
+                                home_score, away_score, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(id) DO UPDATE SET
+                competition=excluded.competition,
+                matchday=excluded.matchday,
+                kickoff=excluded.kickoff,
+                status=excluded.status,
+                home_team=excluded.home_team,
+                away_team=excluded.away_team,
+                home_score=excluded.home_score,
+                away_score=excluded.away_score,
+                updated_at=excluded.updated_at
+        """, rows)
+
+def parse_competitions(value):
+    codes = [c for c in (value or DEFAULT_COMPETITION).split(",") if c]
+    return codes or [DEFAULT_COMPETITION]
+
+def league_competitions(league):
+    row = db.reader().execute("SELECT competitions FROM leagues WHERE name=?", (league,)).fetchone()
+    return parse_competitions(row[0] if row else None)
+
+def active_competitions():
+    """Competizioni scelte da almeno una lega: le uniche da tenere aggiornate."""
+    rows = db.reader().execute("SELECT DISTINCT competitions FROM leagues").fetchall()
+    return sorted({c for (value,) in rows for c in parse_competitions(value)}) or [DEFAULT_COMPETITION]
+
+fetch_pool = ThreadPoolExecutor(max_workers=FETCH_WORKERS, thread_name_prefix="fetch")
+
+def sync_matches(max_age=None, priority="interactive", competitions=None):
+    """Aggiorna la fotografia locale della stagione, una richiesta senza filtro di stato per competizione.
+
+    Le competizioni (di default tutte quelle attive) si scaricano in parallelo; calendario,
+    partite in corso e risultati finiscono poi nella tabella matches in un'unica transazione:
+    viste e valutazione leggono tutte la stessa versione, con ricerche indicizzate per id,
+    stato, giornata e orario.
+    """
+    competitions = competitions or active_competitions()
+    fetched = fetch_pool.map(
+        lambda code: (code, get_matches(code, max_age=max_age, priority=priority)), competitions
+    )
+    # Copie annotate: le liste restituite possono essere condivise con altre richieste in volo
+    matches = [dict(m, competition={"code": code}) for code, found in fetched for m in found]
+    store_matches(matches)
+    return len(matches)
+
+# Con il circuito aperto la sonda è un normale aggiornamento: se riesce, la stagione è già fresca
+breaker.probe = lambda: sync_matches(max_age=0, priority="background")
+
+UPCOMING = """status IN ('SCHEDULED', 'TIMED') AND kickoff > :now
+    AND competition IN (SELECT value FROM json_each(:competitions))"""
+
+def upcoming_matches(competitions, through):
+    """Le partite ancora da giocare delle competizioni indicate con kickoff fino a `through` (compreso).
+
+    Ordinate per gruppo (competizione, giornata), i gruppi per prima partita: la giornata 12
+    della Serie A e la 9 della Premier restano separate anche se si giocano insieme.
+    Le partite senza giornata (eliminazione diretta) formano un gruppo per competizione.
+    """
+    return db.reader().execute(f"""
+        SELECT id, home_team, away_team, kickoff, matchday, competition
+        FROM matches
+        WHERE {UPCOMING} AND kickoff <= :through
+        ORDER BY MIN(kickoff) OVER (PARTITION BY competition, matchday), competition, matchday, kickoff
+    """, {"now": int(time.time()), "competitions": json.dumps(competitions),
+          "through": through}).fetchall()
+
+def next_fixtures_window(competitions, after=0):
+    """Fine della finestra successiva ad `after`: FIXTURES_WINDOW dalla prima partita da giocare.
+
+    None se non ci sono altre partite. Si parte dalla prima partita e non da `after`,
+    così le pause (nazionali, fine stagione) non producono pagine vuote.
+    """
+    first = db.reader().execute(f"""
+        SELECT MIN(kickoff) FROM matches WHERE {UPCOMING} AND kickoff > :after
+    """, {"now": int(time.time()), "competitions": json.dumps(competitions),
+          "after": after}).fetchone()[0]
+    return first + FIXTURES_WINDOW if first is not None else None
 
 # ================= EVALUATION =================
+def settle_results(results):
+    """Valuta in blocco tutte le scommesse pendenti sui risultati (match_id, esito, punteggio).
+
+    Tutto avviene in una sola transazione: crediti, classifiche e flag evaluated
+    vengono aggiornati con poche istruzioni set-based invece che riga per riga.
+    """
+    if not results:
+        return 0
+
+    conn = db.writer()
+    cur = conn.cursor()
+    try:
+        cur.execute("BEGIN IMMEDIATE")
+        cur.execute("""
+            CREATE TEMP TABLE IF NOT EXISTS finished_results(
+                match_id INTEGER PRIMARY KEY,
+                result TEXT,
+                score TEXT
+            )
+        """)
+        cur.execute("DELETE FROM temp.finished_results")
+        cur.executemany("INSERT OR REPLACE INTO temp.finished_results VALUES(?,?,?)", results)
+
+        cur.execute("DROP TABLE IF EXISTS temp.settled")
+        cur.execute("""
+            CREATE TEMP TABLE settled AS
+            SELECT b.rowid AS rid, b.email, b.league,
+                   CASE WHEN b.winner = f.result
+                        THEN CASE WHEN b.result = f.score THEN b.amount * 2 ELSE b.amount END
+                        ELSE -b.amount * 2 END AS gain,
+                   CASE WHEN b.winner = f.result
+                        THEN CASE WHEN b.result = f.score THEN 5 ELSE 3 END
+                        ELSE 0 END AS points
+            FROM bets b
+            JOIN temp.finished_results f ON f.match_id = b.match_id
+            WHERE b.evaluated = 0
+        """)
+        updated = cur.execute("SELECT COUNT(*) FROM temp.settled").fetchone()[0]
+
+        if updated:
+            # Aggregati con chiave primaria: gli UPDATE correlati diventano lookup puntuali
+            cur.execute("DROP TABLE IF EXISTS temp.settled_users")
+            cur.execute("CREATE TEMP TABLE settled_users(email TEXT PRIMARY KEY, gain INTEGER)")
+            cur.execute("INSERT INTO temp.settled_users SELECT email, SUM(gain) FROM temp.settled GROUP BY email")
+            cur.execute("DROP TABLE IF EXISTS temp.settled_standings")
+            cur.execute("""
+                CREATE TEMP TABLE settled_standings(
+                    email TEXT,
+                    league TEXT,
+                    points INTEGER,
+                    PRIMARY KEY(email, league)
+                )
+            """)
+            cur.execute("""
+                INSERT INTO temp.settled_standings
+                SELECT email, league, SUM(points) FROM temp.settled GROUP BY email, league
+            """)
+
+            cur.execute("""
+                UPDATE users
+                SET credits = credits + (SELECT gain FROM temp.settled_users s WHERE s.email = users.email)
+                WHERE email IN (SELECT email FROM temp.settled_users)
+            """)
+            cur.execute("""
+                INSERT OR IGNORE INTO standings(email, league, points)
+                SELECT email, league, 0 FROM temp.settled_standings
+            """)
+            cur.execute("""
+                UPDATE standings
+                SET points = points + (
+                    SELECT points FROM temp.settled_standings s
+                    WHERE s.email = standings.email AND s.league = standings.league
+                )
+                WHERE (email, league) IN (SELECT email, league FROM temp.settled_standings)
+            """)
+            cur.execute("UPDATE bets SET evaluated=1 WHERE rowid IN (SELECT rid FROM temp.settled)")
+            refresh_leaderboard(conn, [row[0] for row in cur.execute("SELECT email FROM temp.settled_users")])
+            cur.execute("DROP TABLE temp.settled_users")
+            cur.execute("DROP TABLE temp.settled_standings")
+
+        cur.execute("DROP TABLE temp.settled")
+        conn.commit()
+        return updated
+    except Exception as e:
+        conn.rollback()
+        print(f"Errore valutazione: {e}")
+        return 0
+
+@metrics.timed("evaluate_matches_seconds")
 def evaluate_matches():
-    finished = get_matches("FINISHED")
-    updated = 0
-    
-    for m in finished:
-        mid = m["id"]
-        h = m["score"]["fullTime"]["home"]
-        a = m["score"]["fullTime"]["away"]
+    """Valuta le scommesse pendenti sulle partite concluse della fotografia locale.
+
+    Non interroga l'API: chi la chiama aggiorna prima la stagione con sync_matches().
+    """
+    # Solo le partite finite che hanno ancora scommesse aperte (idx_bets_pending)
+    finished = db.writer().execute("""
+        SELECT id, home_score, away_score
+        FROM matches
+        WHERE status = 'FINISHED'
+          AND home_score IS NOT NULL AND away_score IS NOT NULL
+          AND id IN (SELECT match_id FROM bets WHERE evaluated=0)
+    """).fetchall()
+    metrics.inc("settle_matches_scanned_total", len(finished))
+
+    results = []
+    for mid, h, a in finished:
         result = "1" if h > a else "2" if a > h else "X"
-        score = f"{h}-{a}"
+        results.append((mid, result, f"{h}-{a}"))
+    if not results:
+        return 0
+    updated = settle_results(results)
+    metrics.inc("settle_bets_total", updated)
+    return updated
 
-        cur.execute("""
-            SELECT rowid,email,league,winner,result,amount
-            FROM bets
-            WHERE match_id=? AND evaluated=0
-        """, (mid,))
-
-        for rid, email, league, w, r, amount in cur.fetchall():
-            if w == result:
-                gain = amount
-                if r == score:
-                    gain *= 2
-            else:
-                gain = -amount * 2
+# ================= AUTH =================
+# bcrypt è lento di proposito: gira su un pool dedicato, mai nell'handler Flet
+auth_pool = ThreadPoolExecutor(max_workers=AUTH_WORKERS, thread_name_prefix="bcrypt")
+
+def hash_password(password):
+    return bcrypt.hashpw(password.encode(), bcrypt.gensalt(BCRYPT_ROUNDS)).decode()
+
+def hash_rounds(hashed):
+    try:
+        return int(hashed.split("$")[2])
+    except (IndexError, ValueError):
+        return None
+
+def verify_password(password, hashed, rehash=None):
+    """Controlla la password; se l'hash ha un costo diverso da BCRYPT_ROUNDS lo ricalcola e lo passa a rehash."""
+    if not bcrypt.checkpw(password.encode(), hashed.encode()):
+        return False
+    if rehash is not None and hash_rounds(hashed) != BCRYPT_ROUNDS:
+        try:
+            rehash(hash_password(password))
+        except Exception as e:
+            print("Errore aggiornamento hash:", e)
+    return True
+
+def store_user_hash(email, old, new):
+    with db.writer() as conn:
+        conn.execute("UPDATE users SET password=? WHERE email=? AND password=?", (new, email, old))
+
+def store_league_hash(name, old, new):
+    with db.writer() as conn:
+        conn.execute("UPDATE leagues SET password=? WHERE name=? AND password=?", (new, name, old))
+
+# ================= SCHEDULER =================
+def next_settlement_delay(now=None):
+    """Secondi da attendere prima della prossima valutazione, in base alle partite con scommesse pendenti."""
+    now = now or time.time()
+    # POSTPONED, SUSPENDED e CANCELLED non finiranno a breve: non contano
+    live, next_end = db.reader().execute("""
+        SELECT
+            SUM(status IN ('IN_PLAY', 'PAUSED')
+                OR (kickoff + :duration <= :now AND kickoff + :duration + :overdue > :now)),
+            MIN(CASE WHEN kickoff + :duration > :now THEN kickoff + :duration END)
+        FROM matches
+        WHERE status IN ('SCHEDULED', 'TIMED', 'IN_PLAY', 'PAUSED')
+          AND id IN (SELECT DISTINCT match_id FROM bets WHERE evaluated=0)
+    """, {"duration": MATCH_DURATION, "overdue": MATCH_OVERDUE_WINDOW, "now": int(now)}).fetchone()
+
+    # Partite in corso o che dovrebbero essere finite: si controlla spesso
+    if live:
+        return SETTLE_LIVE_INTERVAL
+    if next_end is None:
+        return SETTLE_IDLE_INTERVAL
+    return max(SETTLE_MIN_INTERVAL, min(SETTLE_IDLE_INTERVAL, next_end - now))
+
+def acquire_lease(name, owner, ttl=LEADER_LEASE):
+    """Prende o rinnova il lock `name` per `owner`; riesce solo se libero, scaduto o già suo."""
+    now = time.time()
+    with db.writer() as conn:
+        conn.execute("""
+            INSERT INTO leader_lock(name, owner, expires_at) VALUES (?, ?, ?)
+            ON CONFLICT(name) DO UPDATE SET owner=excluded.owner, expires_at=excluded.expires_at
+            WHERE leader_lock.owner = excluded.owner OR leader_lock.expires_at < ?
+        """, (name, owner, now + ttl, now))
+        row = conn.execute("SELECT owner FROM leader_lock WHERE name=?", (name,)).fetchone()
+    return row is not None and row[0] == owner
+
+def release_lease(name, owner):
+    with db.writer() as conn:
+        conn.execute("DELETE FROM leader_lock WHERE name=? AND owner=?", (name, owner))
+
+class SettlementScheduler:
+    """Sincronizza le partite e valuta le scommesse quando può servire.
+
+    Tra tutti i processi che condividono il database solo chi detiene il lock
+    "settler" lavora; gli altri restano in attesa e subentrano se il lease scade.
+    """
+
+    def __init__(self):
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.lock = threading.RLock()
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self.subscribers = {}
 
-            points = 0
-            if w == result:
-                points = 3
-                if r == score:
-                    points += 2
+    def run(self, stop_event, owner=None):
+        # Un owner per esecuzione: un thread che si sta fermando rilascia solo il proprio lease,
+        # mai quello appena preso dal thread che lo sostituisce
+        owner = owner or f"{self.owner}:{uuid.uuid4().hex[:8]}"
+        try:
+            while not stop_event.is_set():
+                if not acquire_lease("settler", owner):
+                    stop_event.wait(LEADER_RENEW)
+                    continue
+                try:
+                    # Revalida sempre: con l'ETag una stagione invariata costa un 304
+                    sync_matches(max_age=0, priority="background")
+                    updated = evaluate_matches()
+                    if updated > 0:
+                        print(f"✅ Aggiornate {updated} scommesse")
+                        self.notify(updated)
+                    delay = next_settlement_delay()
+                except Exception as e:
+                    print("Errore aggiornamento automatico:", e)
+                    delay = SETTLE_LIVE_INTERVAL
+
+                # Durante l'attesa il lease va rinnovato, altrimenti un altro processo subentra.
+                # A ogni rinnovo si ripianifica: una scommessa appena piazzata su una partita
+                # vicina non deve aspettare l'intervallo deciso quando non c'erano pendenti
+                deadline = time.time() + delay
+                while not stop_event.wait(max(0, min(LEADER_RENEW, deadline - time.time()))):
+                    if time.time() >= deadline or not acquire_lease("settler", owner):
+                        break
+                    try:
+                        deadline = min(deadline, time.time() + next_settlement_delay())
+                    except sqlite3.Error as e:
+                        print("Errore pianificazione valutazione:", e)
+        finally:
+            release_lease("settler", owner)
+
+    def start(self):
+        with self.lock:
+            if self.thread is not None and self.thread.is_alive() and not self.stop_event.is_set():
+                return
+            # Nuovo evento per ogni avvio: un thread in chiusura non viene "risvegliato"
+            self.stop_event = threading.Event()
+            self.thread = threading.Thread(target=self.run, args=(self.stop_event,), daemon=True)
+            self.thread.start()
+
+    def stop(self, timeout=None):
+        with self.lock:
+            self.stop_event.set()
+            thread = self.thread
+        if thread is not None and timeout is not None:
+            thread.join(timeout)
+
+    def subscribe(self, callback):
+        """Registra callback(aggiornate) e avvia il thread condiviso se è il primo iscritto."""
+        key = object()
+        with self.lock:
+            self.subscribers[key] = callback
+            self.start()
+        return key
+
+    def unsubscribe(self, key):
+        """Rimuove un iscritto; il thread si ferma quando non ne resta nessuno."""
+        with self.lock:
+            self.subscribers.pop(key, None)
+            if not self.subscribers:
+                self.stop()
 
+    def notify(self, updated):
+        with self.lock:
+            callbacks = list(self.subscribers.values())
+        for callback in callbacks:
             try:
-                cur.execute("UPDATE users SET credits=credits + ? WHERE email=?", (gain, email))
-                cur.execute("INSERT OR IGNORE INTO standings(email, league, points) VALUES(?,?,0)", (email, league))
-                cur.execute("UPDATE standings SET points=points+? WHERE email=? AND league=?", (points, email, league))
-                cur.execute("UPDATE bets SET evaluated=1 WHERE rowid=?", (rid,))
-                updated += 1
+                callback(updated)
             except Exception as e:
-                print(f"Errore valutazione: {e}")
-                
-    conn.commit()
-    return updated
+                print("Errore notifica sessione:", e)
+
+scheduler = SettlementScheduler()
+
+def run_settler():
+    """Processo di valutazione senza interfaccia: `python main.py settle`."""
+    stop_event = threading.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, lambda *_: stop_event.set())
+    owner = f"{scheduler.owner}:{uuid.uuid4().hex[:8]}"
+    print(f"⚙️ Valutazione automatica avviata ({owner})")
+    scheduler.run(stop_event, owner)
+    db.close_all()
+    print("⚙️ Valutazione automatica fermata")
 
 # ================= SESSION =================
-def save_session(email, league):
-    with open(SESSION_FILE, "w") as f:
-        f.write(f"{email}\n{league}")
-
-def load_session():
-    if os.path.exists(SESSION_FILE):
-        with open(SESSION_FILE, "r") as f:
-            lines = f.read().splitlines()
-            if len(lines) == 2:
-                return lines[0], lines[1]
-    return None, None
-
-def clear_session():
-    if os.path.exists(SESSION_FILE):
-        os.remove(SESSION_FILE)
+class SessionState:
+    """Stato di una singola sessione (una per ft.Page), mai condiviso tra utenti."""
+
+    def __init__(self):
+        self.user = None
+        self.league = None
+        self.subscription = None
+        self.api_subscription = None
+        # Le schermate si aggiornano da più thread: eventi Flet, pool di aggiornamento,
+        # valutazione e circuito. Rientrante: refresh() richiama le funzioni di caricamento.
+        self.lock = threading.RLock()
+
+def session_hash(token):
+    return hashlib.sha256(token.encode()).hexdigest()
+
+def saved_token(page):
+    saved = page.client_storage.get(SESSION_KEY)
+    if isinstance(saved, dict) and isinstance(saved.get("token"), str):
+        return saved["token"]
+    return None
+
+def save_session(page, email, league):
+    # Il client_storage è modificabile dall'utente: ci va solo un token emesso dal server,
+    # mai l'email o la lega. Ogni accesso ne emette uno nuovo e invalida il precedente.
+    token = secrets.token_urlsafe(32)
+    old = saved_token(page)
+    with db.writer() as conn:
+        if old:
+            conn.execute("DELETE FROM sessions WHERE token_hash=?", (session_hash(old),))
+        conn.execute(
+            "INSERT INTO sessions(token_hash, email, league, last_seen) VALUES(?,?,?,?)",
+            (session_hash(token), email, league, time.time())
+        )
+    page.client_storage.set(SESSION_KEY, {"token": token})
+
+def load_session(page):
+    """(email, lega) della sessione salvata; lega None se l'utente non ne fa più parte."""
+    token = saved_token(page)
+    if not token:
+        return None, None
+    now = time.time()
+    with db.writer() as conn:
+        row = conn.execute(
+            """SELECT s.email, s.league, st.email IS NOT NULL
+               FROM sessions s
+               JOIN users u ON u.email = s.email
+               LEFT JOIN standings st ON st.email = s.email AND st.league = s.league
+               WHERE s.token_hash=? AND s.last_seen > ?""",
+            (session_hash(token), now - SESSION_TTL)
+        ).fetchone()
+        if not row:
+            conn.execute("DELETE FROM sessions WHERE token_hash=?", (session_hash(token),))
+        else:
+            conn.execute("UPDATE sessions SET last_seen=? WHERE token_hash=?", (now, session_hash(token)))
+    if not row:
+        page.client_storage.remove(SESSION_KEY)
+        return None, None
+    email, league, member = row
+    return email, league if member else None
+
+def clear_session(page):
+    token = saved_token(page)
+    if token:
+        with db.writer() as conn:
+            conn.execute("DELETE FROM sessions WHERE token_hash=?", (session_hash(token),))
+    page.client_storage.remove(SESSION_KEY)
 
 # ================= APP =================
-user_logged = None
-current_league = None
-auto_update_thread = None
-stop_update = False
+# Pool fisso per gli aggiornamenti in background: tanti utenti che aprono la schermata
+# insieme non creano un thread (e due connessioni) a testa
+refresh_pool = ThreadPoolExecutor(max_workers=REFRESH_WORKERS, thread_name_prefix="refresh")
 
 def main(page: ft.Page):
-    global user_logged, current_league, auto_update_thread, stop_update
+    state = SessionState()
+    page.data = state
     
     page.title = "⚽ Serie A Predictor"
     page.theme_mode = ft.ThemeMode.DARK
@@ -151,28 +1609,84 @@ def main(page: ft.Page):
     page.padding = 0
     page.bgcolor = "#0a0e27"
     
-    evaluate_matches()
-    saved_email, saved_league = load_session()
-
-    def auto_update_loop():
-        global stop_update
-        while not stop_update:
-            time.sleep(UPDATE_INTERVAL)
-            if not stop_update:
-                updated = evaluate_matches()
-                if updated > 0:
-                    print(f"✅ Aggiornate {updated} scommesse")
+    saved_email, saved_league = load_session(page)
+
+    def on_settled(updated):
+        # Chiamata dal thread di valutazione condiviso
+        if shown["view"] == "tabs" and screens.get("current"):
+            screens[screens["current"]]["refresh"]()
+            page.update()
+            show_snackbar(f"✅ {updated} scommesse aggiornate!", SUCCESS)
+
+    def on_api_state(online):
+        # Chiamata dal thread che ha aperto o chiuso il circuito
+        if shown["view"] == "tabs" and "game" in screens:
+            screens["game"]["refresh"]()
+            page.update()
+        if online:
+            show_snackbar("📡 Connessione ripristinata", SUCCESS)
+        else:
+            show_snackbar("📡 API non raggiungibile: dati dell'ultimo aggiornamento", DANGER)
 
     def start_auto_update():
-        global auto_update_thread, stop_update
-        stop_update = False
-        if auto_update_thread is None or not auto_update_thread.is_alive():
-            auto_update_thread = threading.Thread(target=auto_update_loop, daemon=True)
-            auto_update_thread.start()
+        if SETTLE_IN_UI and state.subscription is None:
+            state.subscription = scheduler.subscribe(on_settled)
+            state.api_subscription = breaker.subscribe(on_api_state)
 
     def stop_auto_update():
-        global stop_update
-        stop_update = True
+        if state.subscription is not None:
+            scheduler.unsubscribe(state.subscription)
+            breaker.unsubscribe(state.api_subscription)
+            state.subscription = state.api_subscription = None
+
+    def on_connect(e):
+        # Riconnessione nella stessa sessione (rete, sospensione): main() non riparte,
+        # quindi l'iscrizione va ripristinata e la schermata riallineata a quanto perso
+        if state.user and state.league:
+            start_auto_update()
+        if shown["view"] == "tabs" and screens.get("current"):
+            screens[screens["current"]]["refresh"]()
+            page.update()
+
+    # Una disconnessione può essere temporanea: ci si disiscrive solo quando la sessione chiude
+    page.on_connect = on_connect
+    page.on_close = lambda e: stop_auto_update()
+
+    # Vista attualmente mostrata: i thread in background aggiornano solo se è ancora la loro
+    shown = {"view": None, "token": 0}
+
+    def show_view(name):
+        page.clean()
+        shown["view"] = name
+        shown["token"] += 1
+        return shown["token"]
+
+    def is_current(token):
+        return shown["token"] == token
+
+    def locked(fn):
+        """Esegue fn tenendo il lock della sessione: lo stato delle schermate non è thread-safe."""
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with state.lock:
+                return fn(*args, **kwargs)
+        return wrapper
+
+    def off_ui(button, fn, args, done):
+        """Esegue fn sul pool bcrypt e poi done(risultato) senza bloccare gli eventi della sessione."""
+        button.disabled = True
+        page.update()
+
+        def finish(future):
+            button.disabled = False
+            try:
+                result = future.result()
+            except Exception as ex:
+                show_snackbar(f"❌ Errore: {ex}", DANGER)
+                return
+            done(result)
+
+        auth_pool.submit(fn, *args).add_done_callback(finish)
 
     def show_snackbar(message, color=SUCCESS):
         page.snack_bar = ft.SnackBar(
@@ -184,7 +1698,7 @@ def main(page: ft.Page):
         page.update()
 
     def login_view():
-        page.clean()
+        show_view("login")
         
         email = ft.TextField(
             label="Email",
@@ -211,34 +1725,45 @@ def main(page: ft.Page):
         )
 
         def enter(e):
-            global user_logged
-            
             if not email.value or not pwd.value:
                 show_snackbar("⚠️ Compila email e password", DANGER)
                 return
                 
-            cur.execute("SELECT password FROM users WHERE email=?", (email.value,))
-            row = cur.fetchone()
-            
-            try:
-                if row:
-                    if not bcrypt.checkpw(pwd.value.encode(), row[0].encode()):
+            row = db.reader().execute("SELECT password FROM users WHERE email=?", (email.value,)).fetchone()
+            user_email, password = email.value, pwd.value
+
+            if row:
+                stored = row[0]
+
+                def logged_in(ok):
+                    if not ok:
                         show_snackbar("❌ Password errata", DANGER)
                         return
                     show_snackbar("✅ Bentornato!", SUCCESS)
-                else:
-                    if not team.value:
-                        show_snackbar("⚠️ Inserisci nome squadra", DANGER)
+                    login_done(user_email)
+
+                off_ui(e.control, verify_password,
+                       (password, stored, lambda new: store_user_hash(user_email, stored, new)), logged_in)
+            else:
+                if not team.value:
+                    show_snackbar("⚠️ Inserisci nome squadra", DANGER)
+                    return
+                team_name = team.value
+
+                def registered(hashed):
+                    try:
+                        with db.writer() as conn:
+                            conn.execute("INSERT INTO users VALUES(?,?,?,?)", (user_email, hashed, team_name, 1000))
+                    except Exception as ex:
+                        show_snackbar(f"❌ Errore: {ex}", DANGER)
                         return
-                    hashed = bcrypt.hashpw(pwd.value.encode(), bcrypt.gensalt()).decode()
-                    cur.execute("INSERT INTO users VALUES(?,?,?,?)", (email.value, hashed, team.value, 1000))
-                    conn.commit()
                     show_snackbar("🎉 Benvenuto! 1000 crediti!", SUCCESS)
-            except Exception as ex:
-                show_snackbar(f"❌ Errore: {ex}", DANGER)
-                return
-                
-            user_logged = email.value
+                    login_done(user_email)
+
+                off_ui(e.control, hash_password, (password,), registered)
+
+        def login_done(user_email):
+            state.user = user_email
             go("league")
 
         page.add(
@@ -283,8 +1808,7 @@ def main(page: ft.Page):
         )
 
     def league_view():
-        page.clean()
-        global current_league
+        show_view("league")
         
         name = ft.TextField(
             label="Nome Lega",
@@ -302,64 +1826,84 @@ def main(page: ft.Page):
             bgcolor=CARD_BG,
             border_color=PRIMARY
         )
+        # Scelte solo alla creazione; chi si unisce gioca sulle competizioni della lega
+        picks = {
+            code: ft.Checkbox(label=label, value=code == DEFAULT_COMPETITION, active_color=PRIMARY)
+            for code, label in COMPETITIONS.items()
+        }
 
         def create_league(e):
             if not name.value or not pwd.value:
                 show_snackbar("⚠️ Compila tutti i campi", DANGER)
                 return
+            chosen = ",".join(code for code, box in picks.items() if box.value)
+            if not chosen:
+                show_snackbar("⚠️ Scegli almeno una competizione", DANGER)
+                return
                 
-            cur.execute("SELECT name FROM leagues WHERE name=?", (name.value,))
-            if cur.fetchone():
+            if db.reader().execute("SELECT name FROM leagues WHERE name=?", (name.value,)).fetchone():
                 show_snackbar("❌ Lega già esistente", DANGER)
                 return
-                
-            try:
-                hashed = bcrypt.hashpw(pwd.value.encode(), bcrypt.gensalt()).decode()
-                cur.execute("INSERT INTO leagues VALUES(?,?)", (name.value, hashed))
-                cur.execute("INSERT INTO standings VALUES(?,?,0)", (user_logged, name.value))
-                conn.commit()
-                current_league = name.value
-                save_session(user_logged, current_league)
-                show_snackbar(f"🎉 Lega '{name.value}' creata!", SUCCESS)
-                start_auto_update()
-                go("game")
-            except Exception as ex:
-                show_snackbar(f"❌ Errore: {ex}", DANGER)
+            league_name = name.value
+
+            def created(hashed):
+                try:
+                    with db.writer() as conn:
+                        conn.execute(
+                            "INSERT INTO leagues(name, password, competitions) VALUES(?,?,?)",
+                            (league_name, hashed, chosen)
+                        )
+                        conn.execute("INSERT INTO standings VALUES(?,?,0)", (state.user, league_name))
+                        refresh_leaderboard(conn, [state.user])
+                    state.league = league_name
+                    save_session(page, state.user, state.league)
+                    show_snackbar(f"🎉 Lega '{league_name}' creata!", SUCCESS)
+                    start_auto_update()
+                    go("game")
+                except Exception as ex:
+                    show_snackbar(f"❌ Errore: {ex}", DANGER)
+
+            off_ui(e.control, hash_password, (pwd.value,), created)
 
         def join_league(e):
             if not name.value or not pwd.value:
                 show_snackbar("⚠️ Compila tutti i campi", DANGER)
                 return
                 
-            cur.execute("SELECT password FROM leagues WHERE name=?", (name.value,))
-            row = cur.fetchone()
-            if not row or not bcrypt.checkpw(pwd.value.encode(), row[0].encode()):
+            row = db.reader().execute("SELECT password FROM leagues WHERE name=?", (name.value,)).fetchone()
+            if not row:
                 show_snackbar("❌ Credenziali errate", DANGER)
                 return
-                
-            cur.execute("SELECT COUNT(*) FROM standings WHERE league=?", (name.value,))
-            if cur.fetchone()[0] >= MAX_PLAYERS:
-                show_snackbar("❌ Lega piena", DANGER)
-                return
-                
-            try:
-                cur.execute("SELECT 1 FROM standings WHERE email=? AND league=?", (user_logged, name.value))
-                if not cur.fetchone():
-                    cur.execute("INSERT INTO standings VALUES(?,?,0)", (user_logged, name.value))
-                    conn.commit()
-                current_league = name.value
-                save_session(user_logged, current_league)
-                show_snackbar(f"✅ Entrato in '{name.value}'!", SUCCESS)
-                start_auto_update()
-                go("game")
-            except Exception as ex:
-                show_snackbar(f"❌ Errore: {ex}", DANGER)
+            league_name, stored = name.value, row[0]
+
+            def joined(ok):
+                if not ok:
+                    show_snackbar("❌ Credenziali errate", DANGER)
+                    return
+
+                if db.reader().execute("SELECT COUNT(*) FROM standings WHERE league=?", (league_name,)).fetchone()[0] >= MAX_PLAYERS:
+                    show_snackbar("❌ Lega piena", DANGER)
+                    return
+                    
+                try:
+                    with db.writer() as conn:
+                        conn.execute("INSERT OR IGNORE INTO standings VALUES(?,?,0)", (state.user, league_name))
+                        refresh_leaderboard(conn, [state.user])
+                    state.league = league_name
+                    save_session(page, state.user, state.league)
+                    show_snackbar(f"✅ Entrato in '{league_name}'!", SUCCESS)
+                    start_auto_update()
+                    go("game")
+                except Exception as ex:
+                    show_snackbar(f"❌ Errore: {ex}", DANGER)
+
+            off_ui(e.control, verify_password,
+                   (pwd.value, stored, lambda new: store_league_hash(league_name, stored, new)), joined)
 
         def logout(e):
-            global user_logged, current_league
-            user_logged = None
-            current_league = None
-            clear_session()
+            state.user = None
+            state.league = None
+            clear_session(page)
             stop_auto_update()
             go("login")
 
@@ -389,7 +1933,9 @@ def main(page: ft.Page):
                             ),
                             ft.Container(height=20),
                             name, pwd,
-                            ft.Container(height=20),
+                            ft.Text("Competizioni (solo per una nuova lega)", size=12, color="grey"),
+                            ft.Row(list(picks.values()), wrap=True, spacing=5, run_spacing=0),
+                            ft.Container(height=10),
                             ft.Row([
                                 ft.ElevatedButton(
                                     "➕ CREA",
@@ -422,24 +1968,31 @@ def main(page: ft.Page):
             )
         )
 
-    def game_view():
-        page.clean()
-        cur.execute("SELECT team,credits FROM users WHERE email=?", (user_logged,))
-        result = cur.fetchone()
-        
-        if not result:
-            go("login")
-            return
-            
-        team, credits = result
+    # Schermate di gioco costruite una volta per lega e poi solo aggiornate
+    screens = {}
+    TABS = ["game", "ranking", "my_bets"]
+
+    def build_game_screen(token):
+        team, credits = db.reader().execute(
+            "SELECT team,credits FROM users WHERE email=?", (state.user,)
+        ).fetchone()
+        wallet = {"credits": credits}
+        competitions = league_competitions(state.league)
+        credits_text = ft.Text(f"💰 {credits}", size=18, weight="bold", color=SUCCESS)
+        loading = ft.ProgressRing(width=16, height=16, stroke_width=2, color=PRIMARY)
+        offline = ft.Container(
+            content=ft.Text("OFFLINE", size=10, weight="bold", color=DANGER),
+            tooltip="API non raggiungibile: partite e risultati dell'ultimo aggiornamento",
+            border=ft.border.all(1, DANGER),
+            border_radius=6,
+            padding=ft.padding.symmetric(horizontal=6, vertical=2),
+            visible=breaker.offline
+        )
 
         def manual_update(e):
-            updated = evaluate_matches()
-            if updated > 0:
-                show_snackbar(f"✅ {updated} scommesse aggiornate!", SUCCESS)
-                game_view()
-            else:
-                show_snackbar("ℹ️ Nessun aggiornamento", PRIMARY)
+            loading.visible = True
+            page.update()
+            refresh_pool.submit(refresh_in_background, True)
 
         header = ft.Container(
             content=ft.Column([
@@ -450,18 +2003,22 @@ def main(page: ft.Page):
                     ], spacing=0),
                     ft.Column([
                         ft.Text("Crediti", size=12, color="grey"),
-                        ft.Text(f"💰 {credits}", size=18, weight="bold", color=SUCCESS)
+                        credits_text
                     ], spacing=0, horizontal_alignment="end"),
                 ], alignment="spaceBetween"),
                 ft.Row([
-                    ft.Text(f"Lega: {current_league}", size=12, color="grey"),
-                    ft.IconButton(
-                        "refresh",
-                        on_click=manual_update,
-                        tooltip="Aggiorna",
-                        icon_size=20,
-                        icon_color=PRIMARY
-                    )
+                    ft.Text(f"Lega: {state.league}", size=12, color="grey"),
+                    ft.Row([
+                        offline,
+                        loading,
+                        ft.IconButton(
+                            "refresh",
+                            on_click=manual_update,
+                            tooltip="Aggiorna",
+                            icon_size=20,
+                            icon_color=PRIMARY
+                        )
+                    ], spacing=0)
                 ], alignment="spaceBetween")
             ], spacing=5),
             bgcolor=CARD_BG,
@@ -469,364 +2026,525 @@ def main(page: ft.Page):
             border_radius=10
         )
 
-        matches = get_matches()[:8]
-        
-        if not matches:
-            col = ft.Column([
-                ft.Container(
-                    content=ft.Column([
-                        ft.Icon("event_busy", size=60, color="grey"),
-                        ft.Text("Nessuna partita disponibile", size=16, color="grey")
-                    ], horizontal_alignment="center", spacing=10),
-                    padding=50
-                )
-            ])
-        else:
-            col = ft.Column(scroll="always", expand=True, spacing=10)
+        empty = ft.Container(
+            content=ft.Column([
+                ft.Icon("event_busy", size=60, color="grey"),
+                ft.Text("Nessuna partita disponibile", size=16, color="grey")
+            ], horizontal_alignment="center", spacing=10),
+            padding=50
+        )
 
-            for m in matches:
-                match_date = datetime.fromisoformat(m["utcDate"].replace("Z", "+00:00"))
-                date_str = match_date.strftime("%d/%m %H:%M")
-                
-                w = ft.Dropdown(
-                    label="Pronostico",
-                    options=[
-                        ft.dropdown.Option("1", "🏠 Casa"),
-                        ft.dropdown.Option("X", "🤝 Pareggio"),
-                        ft.dropdown.Option("2", "✈️ Trasferta")
-                    ],
-                    border_radius=10,
-                    bgcolor=CARD_BG,
-                    border_color=PRIMARY
-                )
-                r = ft.TextField(
-                    label="Risultato esatto (es. 2-1)",
-                    border_radius=10,
+        def refresh_credits():
+            row = db.reader().execute("SELECT credits FROM users WHERE email=?", (state.user,)).fetchone()
+            if row and row[0] != wallet["credits"]:
+                wallet["credits"] = row[0]
+                credits_text.value = f"💰 {row[0]}"
+
+        def match_card(match_id, home_team, away_team, kickoff, competition, existing):
+            date_str = datetime.fromtimestamp(kickoff, timezone.utc).strftime("%d/%m %H:%M")
+            if len(competitions) > 1:
+                date_str = f"{COMPETITIONS.get(competition, competition)} · {date_str}"
+
+            if existing:
+                return ft.Container(
+                    content=ft.Column([
+                        ft.Row([
+                            ft.Text(home_team, size=14, weight="bold", expand=1),
+                            ft.Text("VS", size=12, color=PRIMARY),
+                            ft.Text(away_team, size=14, weight="bold", expand=1, text_align="right"),
+                        ]),
+                        ft.Text(date_str, size=11, color="grey"),
+                        ft.Divider(height=1, color="grey"),
+                        ft.Container(
+                            content=ft.Row([
+                                ft.Icon("check_circle", color=SUCCESS, size=20),
+                                ft.Column([
+                                    ft.Text("Scommessa piazzata", size=12, weight="bold", color=SUCCESS),
+                                    ft.Text(f"Pronostico: {existing[0]} | Risultato: {existing[1]}", size=11),
+                                    ft.Text(f"Importo: {existing[2]} CR", size=11, weight="bold")
+                                ], spacing=2, expand=1)
+                            ], spacing=10),
+                            bgcolor="#10b98120",
+                            padding=10,
+                            border_radius=8
+                        )
+                    ], spacing=8),
                     bgcolor=CARD_BG,
-                    border_color=PRIMARY
-                )
-                bet_amount = ft.TextField(
-                    label="Crediti",
-                    value="10",
-                    keyboard_type=ft.KeyboardType.NUMBER,
+                    padding=15,
                     border_radius=10,
-                    bgcolor=CARD_BG,
-                    border_color=PRIMARY,
-                    width=120
+                    border=ft.border.all(1, SUCCESS)
                 )
 
-                cur.execute("SELECT winner,result,amount FROM bets WHERE email=? AND match_id=? AND league=?", 
-                           (user_logged, m["id"], current_league))
-                existing = cur.fetchone()
+            w = ft.Dropdown(
+                label="Pronostico",
+                options=[
+                    ft.dropdown.Option("1", "🏠 Casa"),
+                    ft.dropdown.Option("X", "🤝 Pareggio"),
+                    ft.dropdown.Option("2", "✈️ Trasferta")
+                ],
+                border_radius=10,
+                bgcolor=CARD_BG,
+                border_color=PRIMARY
+            )
+            r = ft.TextField(
+                label="Risultato esatto (es. 2-1)",
+                border_radius=10,
+                bgcolor=CARD_BG,
+                border_color=PRIMARY
+            )
+            bet_amount = ft.TextField(
+                label="Crediti",
+                value="10",
+                keyboard_type=ft.KeyboardType.NUMBER,
+                border_radius=10,
+                bgcolor=CARD_BG,
+                border_color=PRIMARY,
+                width=120
+            )
 
-                if existing:
-                    col.controls.append(ft.Container(
-                        content=ft.Column([
-                            ft.Row([
-                                ft.Text(m['homeTeam']['name'], size=14, weight="bold", expand=1),
-                                ft.Text("VS", size=12, color=PRIMARY),
-                                ft.Text(m['awayTeam']['name'], size=14, weight="bold", expand=1, text_align="right"),
-                            ]),
-                            ft.Text(date_str, size=11, color="grey"),
-                            ft.Divider(height=1, color="grey"),
-                            ft.Container(
-                                content=ft.Row([
-                                    ft.Icon("check_circle", color=SUCCESS, size=20),
-                                    ft.Column([
-                                        ft.Text("Scommessa piazzata", size=12, weight="bold", color=SUCCESS),
-                                        ft.Text(f"Pronostico: {existing[0]} | Risultato: {existing[1]}", size=11),
-                                        ft.Text(f"Importo: {existing[2]} CR", size=11, weight="bold")
-                                    ], spacing=2, expand=1)
-                                ], spacing=10),
-                                bgcolor="#10b98120",
-                                padding=10,
-                                border_radius=8
-                            )
-                        ], spacing=8),
-                        bgcolor=CARD_BG,
-                        padding=15,
-                        border_radius=10,
-                        border=ft.border.all(1, SUCCESS)
-                    ))
-                    continue
+            def bet(e, match_id=match_id, winner=w, result=r, amount_field=bet_amount):
+                try:
+                    amount = int(amount_field.value)
+                    if amount <= 0:
+                        raise ValueError("Importo deve essere positivo")
+                    if amount > wallet["credits"]:
+                        raise ValueError("Crediti insufficienti")
+                except ValueError as ex:
+                    show_snackbar(f"⚠️ {ex}", DANGER)
+                    return
 
-                def bet(e, match=m, winner=w, result=r, amount_field=bet_amount):
-                    try:
-                        amount = int(amount_field.value)
-                        if amount <= 0:
-                            raise ValueError("Importo deve essere positivo")
-                        if amount > credits:
-                            raise ValueError("Crediti insufficienti")
-                    except ValueError as ex:
-                        show_snackbar(f"⚠️ {ex}", DANGER)
-                        return
+                if not winner.value:
+                    show_snackbar("⚠️ Seleziona pronostico", DANGER)
+                    return
 
-                    if not winner.value:
-                        show_snackbar("⚠️ Seleziona pronostico", DANGER)
-                        return
+                if not result.value or not re.match(r'^\d+-\d+$', result.value):
+                    show_snackbar("⚠️ Formato: 2-1", DANGER)
+                    return
 
-                    if not result.value or not re.match(r'^\d+-\d+$', result.value):
-                        show_snackbar("⚠️ Formato: 2-1", DANGER)
-                        return
+                try:
+                    place_bet(state.user, state.league, match_id, winner.value, result.value, amount)
+                except Exception as ex:
+                    show_snackbar(f"❌ Errore: {ex}", DANGER)
+                    return
 
-                    try:
-                        cur.execute("""
-                            INSERT INTO bets (email, league, match_id, winner, result, amount, evaluated) 
-                            VALUES (?, ?, ?, ?, ?, ?, 0)
-                        """, (user_logged, current_league, match["id"], winner.value, result.value, amount))
-                        
-                        cur.execute("UPDATE users SET credits=credits-? WHERE email=?", (amount, user_logged))
-                        conn.commit()
-                        
-                        show_snackbar(f"✅ Scommessa di {amount} CR piazzata!", SUCCESS)
-                        game_view()
-                        
-                    except Exception as ex:
-                        show_snackbar(f"❌ Errore: {ex}", DANGER)
+                # Cambiano solo i crediti e la card di questa partita
+                refresh_credits()
+                reload_cards()
+                show_snackbar(f"✅ Scommessa di {amount} CR piazzata!", SUCCESS)
 
-                col.controls.append(ft.Container(
-                    content=ft.Column([
-                        ft.Row([
-                            ft.Text(m['homeTeam']['name'], size=14, weight="bold", expand=1),
-                            ft.Text("VS", size=12, color=PRIMARY, weight="bold"),
-                            ft.Text(m['awayTeam']['name'], size=14, weight="bold", expand=1, text_align="right"),
-                        ]),
-                        ft.Text(date_str, size=11, color="grey"),
-                        ft.Divider(height=1, color="grey"),
-                        w, ft.Row([r, bet_amount], spacing=10),
-                        ft.ElevatedButton(
-                            "⚽ PUNTA",
-                            on_click=bet,
-                            width=200,
-                            height=45,
-                            style=ft.ButtonStyle(
-                                bgcolor=PRIMARY,
-                                color="black",
-                                shape=ft.RoundedRectangleBorder(radius=10)
-                            )
+            return ft.Container(
+                content=ft.Column([
+                    ft.Row([
+                        ft.Text(home_team, size=14, weight="bold", expand=1),
+                        ft.Text("VS", size=12, color=PRIMARY, weight="bold"),
+                        ft.Text(away_team, size=14, weight="bold", expand=1, text_align="right"),
+                    ]),
+                    ft.Text(date_str, size=11, color="grey"),
+                    ft.Divider(height=1, color="grey"),
+                    w, ft.Row([r, bet_amount], spacing=10),
+                    ft.ElevatedButton(
+                        "⚽ PUNTA",
+                        on_click=bet,
+                        width=200,
+                        height=45,
+                        style=ft.ButtonStyle(
+                            bgcolor=PRIMARY,
+                            color="black",
+                            shape=ft.RoundedRectangleBorder(radius=10)
                         )
-                    ], spacing=10, horizontal_alignment="center"),
-                    bgcolor=CARD_BG,
-                    padding=15,
-                    border_radius=10
-                ))
-
-        nav = ft.NavigationBar(
-            selected_index=0,
-            on_change=lambda e: [game_view, ranking_view, my_bets_view][e.control.selected_index](),
-            destinations=[
-                ft.NavigationBarDestination(icon="sports_soccer", label="Partite"),
-                ft.NavigationBarDestination(icon="leaderboard", label="Classifica"),
-                ft.NavigationBarDestination(icon="history", label="Le mie"),
-            ],
-            bgcolor=CARD_BG
-        )
+                    )
+                ], spacing=10, horizontal_alignment="center"),
+                bgcolor=CARD_BG,
+                padding=15,
+                border_radius=10
+            )
 
-        page.add(
-            ft.Column([
-                header,
-                ft.Container(content=col, expand=True, padding=ft.padding.only(left=10, right=10)),
-                nav
-            ], spacing=10, expand=True)
-        )
+        # match_id -> (dati partita e scommessa, card): le card invariate vengono riusate
+        cards = {}
+        headers = {}
+        # Kickoff fino al quale le partite sono caricate (None = nessuna finestra ancora)
+        loaded = {"through": None}
+        col = ft.Column(scroll="always", expand=True, spacing=10)
 
-    def ranking_view():
-        page.clean()
-        
-        cur.execute("""
-            SELECT u.team, s.points, u.credits
-            FROM standings s
-            JOIN users u ON u.email=s.email
-            WHERE s.league=?
-            ORDER BY s.points DESC, u.credits DESC
-        """, (current_league,))
-
-        results = cur.fetchall()
+        @locked
+        def load_next(e):
+            # Le settimane successive si caricano solo su richiesta
+            through = next_fixtures_window(competitions, loaded["through"] or 0)
+            if through is not None:
+                loaded["through"] = through
+            reload_cards()
+            page.update()
+
+        more = ft.TextButton("Partite successive", icon="expand_more", on_click=load_next)
+
+        def group_title(competition, matchday):
+            title = f"Giornata {matchday}" if matchday is not None else "Eliminazione diretta"
+            if len(competitions) > 1:
+                title = f"{COMPETITIONS.get(competition, competition)} · {title}"
+            return title
+
+        def render_cards(fixtures):
+            existing = user_bets_for(state.user, state.league, [f[0] for f in fixtures])
+
+            controls = []
+            group = None
+            for match_id, home_team, away_team, kickoff, matchday, competition in fixtures:
+                if (competition, matchday) != group:
+                    group = (competition, matchday)
+                    if group not in headers:
+                        headers[group] = ft.Text(group_title(*group), size=14, weight="bold", color="grey")
+                    controls.append(headers[group])
+
+                key = (home_team, away_team, kickoff, competition, existing.get(match_id))
+                known = cards.get(match_id)
+                if not known or known[0] != key:
+                    known = cards[match_id] = (key, match_card(match_id, *key))
+                controls.append(known[1])
+            for match_id in set(cards) - {f[0] for f in fixtures}:
+                del cards[match_id]
+
+            more.visible = (loaded["through"] is not None
+                            and next_fixtures_window(competitions, loaded["through"]) is not None)
+            col.controls = controls + [more] if controls else [empty]
+
+        @locked
+        def reload_cards():
+            fixtures = upcoming_matches(competitions, loaded["through"]) if loaded["through"] else []
+            if not fixtures:
+                # Finestra esaurita (partite iniziate o rinviate): si riparte dalla prossima
+                loaded["through"] = next_fixtures_window(competitions)
+                if loaded["through"] is not None:
+                    fixtures = upcoming_matches(competitions, loaded["through"])
+            render_cards(fixtures)
+
+        def refresh():
+            refresh_credits()
+            reload_cards()
+            offline.visible = breaker.offline
+
+        def refresh_in_background(manual=False):
+            updated = 0
+            try:
+                # Con il processo di valutazione separato l'app legge solo dal database
+                if SETTLE_IN_UI:
+                    sync_matches(max_age=0 if manual else None, competitions=competitions)
+                    if manual:
+                        updated = evaluate_matches()
+            except Exception as e:
+                print("Errore aggiornamento partite:", e)
+
+            if not is_current(token):
+                return
+            try:
+                refresh()
+            except Exception as e:
+                # Eseguita sul pool: senza questo l'errore resterebbe nel Future e la rotella girerebbe
+                print("Errore aggiornamento schermata:", e)
+                show_snackbar(f"❌ Errore: {e}", DANGER)
+                return
+            finally:
+                loading.visible = False
+                page.update()
+            if manual:
+                if updated > 0:
+                    show_snackbar(f"✅ {updated} scommesse aggiornate!", SUCCESS)
+                elif breaker.offline:
+                    show_snackbar("📡 Offline: dati dell'ultimo aggiornamento", DANGER)
+                else:
+                    show_snackbar("ℹ️ Nessun aggiornamento", PRIMARY)
+
+        # Disegna subito con i dati locali, poi aggiorna in background
+        reload_cards()
+        refresh_pool.submit(refresh_in_background)
+
+        root = ft.Column([
+            header,
+            ft.Container(content=col, expand=True, padding=ft.padding.only(left=10, right=10)),
+        ], spacing=10, expand=True)
+        return {"root": root, "refresh": refresh}
+
+    def build_ranking_screen(token):
         col = ft.Column(scroll="always", expand=True, spacing=10)
-        
-        if not results:
-            col.controls.append(ft.Container(
-                content=ft.Column([
-                    ft.Icon("groups", size=60, color="grey"),
-                    ft.Text("Nessun giocatore", size=16, color="grey")
-                ], horizontal_alignment="center", spacing=10),
-                padding=50
-            ))
-        else:
-            for idx, (team_name, points, creds) in enumerate(results, 1):
-                if idx == 1:
-                    icon = "🥇"
-                    color = "#ffd700"
-                elif idx == 2:
-                    icon = "🥈"
-                    color = "#c0c0c0"
-                elif idx == 3:
-                    icon = "🥉"
-                    color = "#cd7f32"
+        empty = ft.Container(
+            content=ft.Column([
+                ft.Icon("groups", size=60, color="grey"),
+                ft.Text("Nessun giocatore", size=16, color="grey")
+            ], horizontal_alignment="center", spacing=10),
+            padding=50
+        )
+        # Una riga per posizione: (dati mostrati, controllo)
+        rows = []
+
+        def ranking_row(idx, team_name, points, creds):
+            if idx == 1:
+                icon = "🥇"
+                color = "#ffd700"
+            elif idx == 2:
+                icon = "🥈"
+                color = "#c0c0c0"
+            elif idx == 3:
+                icon = "🥉"
+                color = "#cd7f32"
+            else:
+                icon = f"{idx}"
+                color = "grey"
+
+            return ft.Container(
+                content=ft.Row([
+                    ft.Container(
+                        content=ft.Text(icon, size=24, weight="bold"),
+                        width=50,
+                        alignment=ft.alignment.center
+                    ),
+                    ft.Column([
+                        ft.Text(team_name, size=16, weight="bold"),
+                        ft.Text(f"💰 {creds} CR", size=12, color="grey")
+                    ], spacing=2, expand=1),
+                    ft.Container(
+                        content=ft.Text(f"{points}", size=20, weight="bold", color=PRIMARY),
+                        bgcolor="#00d4ff20",
+                        padding=10,
+                        border_radius=8
+                    )
+                ], alignment="spaceBetween"),
+                bgcolor=CARD_BG,
+                padding=15,
+                border_radius=10,
+                border=ft.border.all(2, color) if idx <= 3 else None
+            )
+
+        @locked
+        def refresh():
+            results = league_leaderboard(state.league)
+            # Si ricostruiscono solo le posizioni il cui contenuto è cambiato
+            for idx, data in enumerate(results):
+                if idx < len(rows):
+                    if rows[idx][0] != data:
+                        rows[idx] = (data, ranking_row(idx + 1, *data))
                 else:
-                    icon = f"{idx}"
-                    color = "grey"
-                    
-                col.controls.append(ft.Container(
-                    content=ft.Row([
-                        ft.Container(
-                            content=ft.Text(icon, size=24, weight="bold"),
-                            width=50,
-                            alignment=ft.alignment.center
-                        ),
-                        ft.Column([
-                            ft.Text(team_name, size=16, weight="bold"),
-                            ft.Text(f"💰 {creds} CR", size=12, color="grey")
-                        ], spacing=2, expand=1),
+                    rows.append((data, ranking_row(idx + 1, *data)))
+            del rows[len(results):]
+            col.controls = [row for _, row in rows] or [empty]
+
+        refresh()
+        root = ft.Column([
+            ft.Container(
+                content=ft.Row([
+                    ft.Icon("emoji_events", color=PRIMARY),
+                    ft.Text(f"Classifica - {state.league}", size=20, weight="bold"),
+                    ft.IconButton(
+                        "logout",
+                        on_click=lambda _: go("league"),
+                        tooltip="Cambia lega",
+                        icon_color=DANGER
+                    )
+                ], alignment="spaceBetween"),
+                bgcolor=CARD_BG,
+                padding=15,
+                border_radius=10
+            ),
+            ft.Container(content=col, expand=True, padding=ft.padding.only(left=10, right=10)),
+        ], spacing=10, expand=True)
+        return {"root": root, "refresh": refresh}
+
+    def build_my_bets_screen(token):
+        lv = ft.ListView(expand=True, spacing=10, on_scroll_interval=100)
+
+        def pending_card(fixture, winner, result, amount):
+            return ft.Container(
+                content=ft.Column([
+                    ft.Row([
+                        ft.Text(fixture, size=12, color="grey"),
                         ft.Container(
-                            content=ft.Text(f"{points}", size=20, weight="bold", color=PRIMARY),
-                            bgcolor="#00d4ff20",
-                            padding=10,
-                            border_radius=8
+                            content=ft.Text("IN ATTESA", size=10, weight="bold"),
+                            bgcolor="#f59e0b20",
+                            padding=5,
+                            border_radius=5
                         )
                     ], alignment="spaceBetween"),
-                    bgcolor=CARD_BG,
-                    padding=15,
-                    border_radius=10,
-                    border=ft.border.all(2, color) if idx <= 3 else None
-                ))
-
-        nav = ft.NavigationBar(
-            selected_index=1,
-            on_change=lambda e: [game_view, ranking_view, my_bets_view][e.control.selected_index](),
-            destinations=[
-                ft.NavigationBarDestination(icon="sports_soccer", label="Partite"),
-                ft.NavigationBarDestination(icon="leaderboard", label="Classifica"),
-                ft.NavigationBarDestination(icon="history", label="Le mie"),
-            ],
-            bgcolor=CARD_BG
-        )
+                    ft.Text(f"Pronostico: {winner} | Risultato: {result}", size=14),
+                    ft.Text(f"Importo: {amount} CR", size=14, weight="bold", color=PRIMARY)
+                ], spacing=5),
+                bgcolor=CARD_BG,
+                padding=15,
+                border_radius=10,
+                border=ft.border.all(1, "#f59e0b")
+            )
 
-        page.add(
-            ft.Column([
-                ft.Container(
-                    content=ft.Row([
-                        ft.Icon("emoji_events", color=PRIMARY),
-                        ft.Text(f"Classifica - {current_league}", size=20, weight="bold"),
-                        ft.IconButton(
-                            "logout",
-                            on_click=lambda _: go("league"),
-                            tooltip="Cambia lega",
-                            icon_color=DANGER
+        def settled_card(fixture, winner, result, amount):
+            return ft.Container(
+                content=ft.Column([
+                    ft.Row([
+                        ft.Text(fixture, size=12, color="grey"),
+                        ft.Container(
+                            content=ft.Text("VALUTATA", size=10, weight="bold"),
+                            bgcolor="#10b98120",
+                            padding=5,
+                            border_radius=5
                         )
                     ], alignment="spaceBetween"),
-                    bgcolor=CARD_BG,
-                    padding=15,
-                    border_radius=10
-                ),
-                ft.Container(content=col, expand=True, padding=ft.padding.only(left=10, right=10)),
-                nav
-            ], spacing=10, expand=True)
+                    ft.Text(f"Pronostico: {winner} | Risultato: {result}", size=14),
+                    ft.Text(f"Importo: {amount} CR", size=14, weight="bold")
+                ], spacing=5),
+                bgcolor=CARD_BG,
+                padding=15,
+                border_radius=10
+            )
+
+        # Ogni sezione ha il proprio cursore e si carica indipendentemente dall'altra
+        sections = [
+            {"evaluated": 0, "card": pending_card, "count": None,
+             "title": ft.Text("⏳ In attesa", size=18, weight="bold", color=PRIMARY)},
+            {"evaluated": 1, "card": settled_card, "count": None,
+             "title": ft.Text("✅ Valutate", size=18, weight="bold", color=SUCCESS)},
+        ]
+
+        def reset(section):
+            section.update(items=[], after=None, done=False, busy=False)
+
+        for section in sections:
+            reset(section)
+            section["more"] = ft.TextButton(
+                "Mostra altre",
+                on_click=lambda e, section=section: load_more(section)
+            )
+
+        empty = ft.Container(
+            content=ft.Column([
+                ft.Icon("receipt_long", size=60, color="grey"),
+                ft.Text("Nessuna scommessa", size=16, color="grey")
+            ], horizontal_alignment="center", spacing=10),
+            padding=50
         )
 
-    def my_bets_view():
-        page.clean()
-        
-        cur.execute("""
-            SELECT match_id, winner, result, amount, evaluated
-            FROM bets
-            WHERE email=? AND league=?
-            ORDER BY evaluated ASC, match_id DESC
-        """, (user_logged, current_league))
+        @locked
+        def load_more(section, update=True):
+            if section["done"] or section["busy"] or not is_current(token):
+                return
+            section["busy"] = True
+            try:
+                rows = bets_page(state.user, state.league, section["evaluated"], section["after"])
+                if rows:
+                    section["after"] = (rows[-1][0], rows[-1][1])
+                    section["items"] += [section["card"](fixture, w, r, amount) for _, _, w, r, amount, fixture in rows]
+                section["done"] = len(rows) < BETS_PAGE_SIZE
+            finally:
+                section["busy"] = False
+            layout()
+            if update:
+                lv.update()
 
-        bets = cur.fetchall()
-        col = ft.Column(scroll="always", expand=True, spacing=10)
-        
-        if not bets:
-            col.controls.append(ft.Container(
-                content=ft.Column([
-                    ft.Icon("receipt_long", size=60, color="grey"),
-                    ft.Text("Nessuna scommessa", size=16, color="grey")
-                ], horizontal_alignment="center", spacing=10),
-                padding=50
-            ))
+        def layout():
+            controls = []
+            for section in sections:
+                if section["items"]:
+                    controls.append(section["title"])
+                    controls += section["items"]
+                    if not section["done"]:
+                        controls.append(section["more"])
+            lv.controls = controls or [empty]
+
+        def on_scroll(e):
+            # Vicino al fondo: carica la prima sezione che ha ancora pagine
+            if e.pixels < e.max_scroll_extent - 300:
+                return
+            for section in sections:
+                if not section["done"]:
+                    load_more(section)
+                    break
+
+        @locked
+        def refresh():
+            # Una sezione si ricarica solo se il numero di scommesse che contiene è cambiato
+            pending, total = db.reader().execute(
+                "SELECT COUNT(*) - COALESCE(SUM(evaluated), 0), COUNT(*) FROM bets WHERE email=? AND league=?",
+                (state.user, state.league)
+            ).fetchone()
+            for section, count in zip(sections, (pending, total - pending)):
+                if section["count"] != count:
+                    section["count"] = count
+                    reset(section)
+                    load_more(section, update=False)
+
+        lv.on_scroll = on_scroll
+        refresh()
+        root = ft.Column([
+            ft.Container(
+                content=ft.Row([
+                    ft.Icon("receipt_long", color=PRIMARY),
+                    ft.Text("Le mie scommesse", size=20, weight="bold"),
+                    ft.IconButton(
+                        "logout",
+                        on_click=lambda _: go("league"),
+                        tooltip="Cambia lega",
+                        icon_color=DANGER
+                    )
+                ], alignment="spaceBetween"),
+                bgcolor=CARD_BG,
+                padding=15,
+                border_radius=10
+            ),
+            ft.Container(content=lv, expand=True, padding=ft.padding.only(left=10, right=10)),
+        ], spacing=10, expand=True)
+        return {"root": root, "refresh": refresh}
+
+    SCREEN_BUILDERS = {"game": build_game_screen, "ranking": build_ranking_screen, "my_bets": build_my_bets_screen}
+
+    @locked
+    def show_tab(index):
+        if shown["view"] != "tabs":
+            # La lega dev'essere ancora dell'utente: la sessione può essere vecchia o la lega cambiata
+            member = db.reader().execute(
+                """SELECT st.email IS NOT NULL FROM users u
+                   LEFT JOIN standings st ON st.email = u.email AND st.league = ?
+                   WHERE u.email=?""",
+                (state.league, state.user)
+            ).fetchone()
+            if not member:
+                go("login")
+                return
+            if not member[0]:
+                state.league = None
+                go("league")
+                return
+            token = show_view("tabs")
+            screens.clear()
+            nav = ft.NavigationBar(
+                selected_index=index,
+                on_change=lambda e: show_tab(e.control.selected_index),
+                destinations=[
+                    ft.NavigationBarDestination(icon="sports_soccer", label="Partite"),
+                    ft.NavigationBarDestination(icon="leaderboard", label="Classifica"),
+                    ft.NavigationBarDestination(icon="history", label="Le mie"),
+                ],
+                bgcolor=CARD_BG
+            )
+            body = ft.Column(expand=True, spacing=0)
+            screens["body"] = body
+            page.add(ft.Column([body, nav], spacing=10, expand=True))
+
+        # Le schermate si costruiscono alla prima apertura, poi restano vive e si aggiornano
+        # Tempi separati: costruzione/aggiornamento dei controlli (SQLite) e invio al client (Flet)
+        name = TABS[index]
+        if name not in screens:
+            with metrics.timer("view_build_seconds", view=name, phase="build"):
+                screens[name] = SCREEN_BUILDERS[name](shown["token"])
+            screens["body"].controls.append(screens[name]["root"])
         else:
-            pending = [b for b in bets if not b[4]]
-            evaluated = [b for b in bets if b[4]]
-            
-            if pending:
-                col.controls.append(ft.Text("⏳ In attesa", size=18, weight="bold", color=PRIMARY))
-                for match_id, winner, result, amount, _ in pending:
-                    col.controls.append(ft.Container(
-                        content=ft.Column([
-                            ft.Row([
-                                ft.Text(f"Match #{match_id}", size=12, color="grey"),
-                                ft.Container(
-                                    content=ft.Text("IN ATTESA", size=10, weight="bold"),
-                                    bgcolor="#f59e0b20",
-                                    padding=5,
-                                    border_radius=5
-                                )
-                            ], alignment="spaceBetween"),
-                            ft.Text(f"Pronostico: {winner} | Risultato: {result}", size=14),
-                            ft.Text(f"Importo: {amount} CR", size=14, weight="bold", color=PRIMARY)
-                        ], spacing=5),
-                        bgcolor=CARD_BG,
-                        padding=15,
-                        border_radius=10,
-                        border=ft.border.all(1, "#f59e0b")
-                    ))
-            
-            if evaluated:
-                col.controls.append(ft.Container(height=10))
-                col.controls.append(ft.Text("✅ Valutate", size=18, weight="bold", color=SUCCESS))
-                for match_id, winner, result, amount, _ in evaluated:
-                    col.controls.append(ft.Container(
-                        content=ft.Column([
-                            ft.Row([
-                                ft.Text(f"Match #{match_id}", size=12, color="grey"),
-                                ft.Container(
-                                    content=ft.Text("VALUTATA", size=10, weight="bold"),
-                                    bgcolor="#10b98120",
-                                    padding=5,
-                                    border_radius=5
-                                )
-                            ], alignment="spaceBetween"),
-                            ft.Text(f"Pronostico: {winner} | Risultato: {result}", size=14),
-                            ft.Text(f"Importo: {amount} CR", size=14, weight="bold")
-                        ], spacing=5),
-                        bgcolor=CARD_BG,
-                        padding=15,
-                        border_radius=10
-                    ))
-
-        nav = ft.NavigationBar(
-            selected_index=2,
-            on_change=lambda e: [game_view, ranking_view, my_bets_view][e.control.selected_index](),
-            destinations=[
-                ft.NavigationBarDestination(icon="sports_soccer", label="Partite"),
-                ft.NavigationBarDestination(icon="leaderboard", label="Classifica"),
-                ft.NavigationBarDestination(icon="history", label="Le mie"),
-            ],
-            bgcolor=CARD_BG
-        )
+            with metrics.timer("view_build_seconds", view=name, phase="refresh"):
+                screens[name]["refresh"]()
+        screens["current"] = name
+        for tab in TABS:
+            if tab in screens:
+                screens[tab]["root"].visible = tab == name
+        with metrics.timer("view_update_seconds", view=name):
+            page.update()
 
-        page.add(
-            ft.Column([
-                ft.Container(
-                    content=ft.Row([
-                        ft.Icon("receipt_long", color=PRIMARY),
-                        ft.Text("Le mie scommesse", size=20, weight="bold"),
-                        ft.IconButton(
-                            "logout",
-                            on_click=lambda _: go("league"),
-                            tooltip="Cambia lega",
-                            icon_color=DANGER
-                        )
-                    ], alignment="spaceBetween"),
-                    bgcolor=CARD_BG,
-                    padding=15,
-                    border_radius=10
-                ),
-                ft.Container(content=col, expand=True, padding=ft.padding.only(left=10, right=10)),
-                nav
-            ], spacing=10, expand=True)
-        )
+    def game_view():
+        show_tab(0)
+
+    def ranking_view():
+        show_tab(1)
 
     def go(view):
         page.clean()
@@ -839,11 +2557,23 @@ def main(page: ft.Page):
         page.update()
 
     if saved_email and saved_league:
-        user_logged = saved_email
-        current_league = saved_league
+        state.user = saved_email
+        state.league = saved_league
         start_auto_update()
         game_view()
+    elif saved_email:
+        # Utente valido ma non più nella lega salvata: si sceglie di nuovo
+        state.user = saved_email
+        go("league")
     else:
         go("login")
 
-ft.app(target=main, view=ft.WEB_BROWSER)
\ No newline at end of file
+if __name__ == "__main__":
+    start_metrics()
+    if sys.argv[1:2] == ["settle"]:
+        run_settler()
+    else:
+        ft.app(target=main, view=ft.WEB_BROWSER)
+        # Il thread di valutazione usa ancora il database: prima si ferma, poi si chiude
+        scheduler.stop(timeout=10)
+        db.close_all()
\ No newline at end of file
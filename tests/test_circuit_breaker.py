@@ -0,0 +1,77 @@
+import os
+import sys
+import tempfile
+
+# main.py applica le migrazioni all'import: database temporaneo e nessuna API reale
+os.environ["DB_PATH"] = os.path.join(tempfile.mkdtemp(), "test.db")
+os.environ["BASE_URL"] = "http://127.0.0.1:9/v4"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+
+
+class FakeResponse:
+    status_code = 200
+    headers = {}
+
+
+def open_breaker(monkeypatch, budget_available):
+    breaker = main.CircuitBreaker(threshold=1, cooldown=60)
+    scheduled = []
+    monkeypatch.setattr(breaker, "schedule_probe", scheduled.append)
+    monkeypatch.setattr(main, "breaker", breaker)
+
+    def acquire(priority="interactive", deadline=None):
+        if not budget_available["value"]:
+            raise main.RateLimited("quota esaurita")
+
+    monkeypatch.setattr(main.budget, "acquire", acquire)
+    monkeypatch.setattr(main.budget, "observe", lambda response: None)
+    monkeypatch.setattr(main.api.session, "get", lambda *args, **kwargs: FakeResponse())
+    breaker.probe = lambda: main.api.get("http://example.test/probe", priority="background")
+
+    breaker.failure()
+    assert breaker.state == "open"
+    assert scheduled == [60]
+    return breaker, scheduled
+
+
+def test_probe_without_budget_releases_trial_and_rearms(monkeypatch):
+    budget_available = {"value": False}
+    breaker, scheduled = open_breaker(monkeypatch, budget_available)
+
+    breaker.run_probe()
+
+    assert breaker.state == "open"
+    assert breaker.trial is False
+    assert scheduled == [60, 60]
+    assert breaker.cooldown == 60
+
+    # Con il budget tornato la sonda successiva chiude il circuito
+    budget_available["value"] = True
+    breaker.run_probe()
+    assert breaker.state == "closed"
+    assert breaker.allow() is True
+
+
+def test_probe_that_never_asks_for_the_trial_is_rearmed(monkeypatch):
+    breaker, scheduled = open_breaker(monkeypatch, {"value": True})
+    breaker.probe = lambda: None
+
+    breaker.run_probe()
+
+    assert breaker.state == "open"
+    assert scheduled == [60, 60]
+
+
+def test_failed_probe_doubles_cooldown(monkeypatch):
+    breaker, scheduled = open_breaker(monkeypatch, {"value": True})
+    failing = FakeResponse()
+    failing.status_code = 503
+    monkeypatch.setattr(main.api, "retries", 0)
+    monkeypatch.setattr(main.api.session, "get", lambda *args, **kwargs: failing)
+
+    breaker.run_probe()
+
+    assert breaker.state == "open"
+    assert scheduled == [60, 120]
@@ -0,0 +1,43 @@
+import os
+import sys
+import tempfile
+import threading
+
+# main.py applica le migrazioni all'import: database temporaneo e nessuna API reale
+os.environ["DB_PATH"] = os.path.join(tempfile.mkdtemp(), "test.db")
+os.environ["BASE_URL"] = "http://127.0.0.1:9/v4"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+
+
+def test_new_bet_shortens_idle_wait(monkeypatch):
+    passes = []
+    second_pass = threading.Event()
+    pending = {"bets": False}
+
+    def evaluate():
+        passes.append(pending["bets"])
+        if len(passes) == 2:
+            second_pass.set()
+        return 0
+
+    monkeypatch.setattr(main, "LEADER_RENEW", 0.05)
+    monkeypatch.setattr(main, "sync_matches", lambda **kwargs: 0)
+    monkeypatch.setattr(main, "evaluate_matches", evaluate)
+    # Senza pendenti si dormirebbe SETTLE_IDLE_INTERVAL; la scommessa porta l'attesa a zero
+    monkeypatch.setattr(main, "next_settlement_delay",
+                        lambda now=None: 0 if pending["bets"] else main.SETTLE_IDLE_INTERVAL)
+
+    stop = threading.Event()
+    thread = threading.Thread(target=main.SettlementScheduler().run, args=(stop,), daemon=True)
+    thread.start()
+    try:
+        while not passes:
+            stop.wait(0.01)
+        pending["bets"] = True
+        assert second_pass.wait(2), "la valutazione resta ferma all'intervallo di riposo"
+        assert passes[:2] == [False, True]
+    finally:
+        stop.set()
+        thread.join(2)